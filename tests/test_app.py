@@ -1,8 +1,38 @@
+import threading
 import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import os
+import gzip
 import hashlib
+import json
+import io
 import mimetypes
+import zipfile
+import zlib
+from flask import Flask
+from jinja2 import DictLoader
+from PIL import Image
+from pypdf import PdfReader
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import BadRequest, TooManyRequests, ServiceUnavailable
+
+from weasyprint_rest.print.asset_directory import AssetDirectoryCache
+from weasyprint_rest.print.asset_store import AssetStore, StoredAsset
+from weasyprint_rest.print.job_store import JobStore, _global as job_store_global
+from weasyprint_rest.print.pdf_merger import PdfMergeEngine
+from weasyprint_rest.web.admission import AdmissionController
+from weasyprint_rest.web.rest.jobs import execute_print_job
+from weasyprint_rest.web.rest.print import iter_records, render_report_template
+from weasyprint_rest.web.uploads import UploadBudget
+from weasyprint_rest.web.url_policy import compile_policy
+from weasyprint_rest.print.render_pool import RenderJob, RenderPool, map_ordered
+from weasyprint_rest.print.reports import configure_reports, precompile_reports
+from weasyprint_rest.print.result_cache import ResultCache
+from weasyprint_rest.print.single_flight import SingleFlight
+from weasyprint_rest.print.template import Template
+from weasyprint_rest.print.template_loader import TemplateLoader
+from weasyprint_rest.print.url_fetcher import ConnectionPool, FetchBudget, HttpCache, UrlFetcher
+from weasyprint_rest.print.wk_runner import WkRunner
 
 
 def test_app():
@@ -27,6 +57,17 @@ def test_get_health_status(client):
     assert "status" in res.json and res.json["status"] == "OK"
 
 
+def test_get_health_starting_until_prewarmed(client):
+    loader = TemplateLoader()
+    loader.ready.clear()
+    try:
+        res = client.get("/api/v1.0/health")
+        assert res.status_code == 503 and res.json["status"] == "STARTING"
+    finally:
+        loader.prewarm()
+    assert client.get("/api/v1.0/health").status_code == 200
+
+
 def test_get_health_timestamp(client):
     min_time = round(time.time() * 1000)
     max_time = min_time + 1000
@@ -169,6 +210,639 @@ def test_post_print_html_without_css_assets(client):
     assert res.status_code == 200
 
 
+def test_post_print_reuses_parsed_style(client):
+    def post():
+        data = get_print_input(False)
+        data["style"] = read_file(get_path("./resources/report"), "blue.css")
+        return post_print(client, data)
+
+    assert post().status_code == 200
+    hits = get_health(client)["stylesheet_cache"]["hits"]
+    assert post().status_code == 200
+    assert get_health(client)["stylesheet_cache"]["hits"] > hits
+
+
+def test_post_print_template_shares_font_config(client):
+    assert post_print(client).status_code == 200
+    hits = get_health(client)["font_registry"]["hits"]
+    assert post_print(client).status_code == 200
+    assert get_health(client)["font_registry"]["hits"] > hits
+
+
+def test_template_font_config_is_not_shared_between_threads():
+    template = Template()
+    configs = []
+    thread = threading.Thread(target=lambda: configs.append(template.get_font_config()))
+    thread.start()
+    thread.join()
+    assert template.get_font_config() is template.get_font_config()
+    assert template.get_font_config() is not configs[0]
+
+
+def test_post_print_template_reuses_images(client):
+    assert post_print(client).status_code == 200
+    hits = get_health(client)["image_cache"]["template"]["hits"]
+    assert post_print(client).status_code == 200
+    assert get_health(client)["image_cache"]["template"]["hits"] > hits
+
+
+def test_render_pool_recycles_worker():
+    pool = RenderPool(1, 1, 1, get_path("./resources/templates"))
+    try:
+        assert pool.ready.wait(60)
+        html = read_file(get_path("./resources/report"), "report.html").read()
+        first = pool.render(RenderJob(html=html, template_name="report"))
+        second = pool.render(RenderJob(html=html, template_name="report"))
+    finally:
+        pool.close()
+
+    assert first.startswith(b"%PDF") and second.startswith(b"%PDF")
+
+
+def test_map_ordered_keeps_input_order():
+    def double(value):
+        # The first entries finish last
+        time.sleep(0.05 * (4 - value))
+        return value * 2
+
+    assert list(map_ordered(double, range(5), 3)) == [0, 2, 4, 6, 8]
+    assert list(map_ordered(double, range(3), 1)) == [0, 2, 4]
+
+    def fail(value):
+        if value == 1:
+            raise ValueError("failed %d" % value)
+        return value
+
+    results = map_ordered(fail, range(4), 2)
+    assert next(results) == 0
+    try:
+        next(results)
+        assert False
+    except ValueError as e:
+        assert str(e) == "failed 1"
+
+
+def test_post_print_data_set_keeps_order_on_render_workers(client, monkeypatch):
+    pool = RenderPool(2, 2, 0, get_path("./resources/templates"))
+    monkeypatch.setattr("weasyprint_rest.web.rest.print.render_pool", lambda: pool)
+    use_reports(monkeypatch, client, **{"ordered-record.html": "<p>{{ name }}</p>"})
+    names = ["first", "second", "third", "fourth", "fifth"]
+    try:
+        res = post_print(client, {
+            "report": "ordered-record.html",
+            "data_set": json.dumps([{"name": name} for name in names])
+        })
+    finally:
+        pool.close()
+    assert res.status_code == 200
+    assert get_page_texts(res.get_data()) == names
+
+
+def test_post_print_data_set_single_document(client, monkeypatch):
+    use_reports(monkeypatch, client, **{"single-record.html": "<p>{{ name }}</p>"})
+    res = post_print(client, {
+        "report": "single-record.html",
+        "data_set": json.dumps([{"name": "first"}, {"name": "second"}]),
+        "single_document": "true"
+    })
+    assert res.status_code == 200
+    assert get_page_texts(res.get_data()) == ["first", "second"]
+
+    pool = RenderPool(1, 1, 0, get_path("./resources/templates"))
+    try:
+        pdf_bytes = pool.render(RenderJob(html=["<p>first</p>", "<p>second</p>"]))
+    finally:
+        pool.close()
+    assert get_page_texts(pdf_bytes) == ["first", "second"]
+
+
+def test_post_print_streams_with_content_length(client):
+    res = post_print(client, {**get_print_input(), "password": "secret"})
+    data = res.get_data()
+    assert res.status_code == 200 and data.startswith(b"%PDF")
+    assert int(res.headers["Content-Length"]) == len(data)
+    assert PdfReader(io.BytesIO(data)).decrypt("secret")
+
+
+def test_post_print_not_modified(client):
+    res = post_print(client)
+    assert res.status_code == 200 and res.headers.get("ETag")
+
+    res = post_print(client, headers={"If-None-Match": res.headers["ETag"]})
+    assert res.status_code == 304
+
+
+def test_result_cache_reads_disk_tier(tmp_path):
+    ResultCache(1024, str(tmp_path), 1024, 60).put("key", b"%PDF-1.7")
+    cache = ResultCache(1024, str(tmp_path), 1024, 60)
+    assert cache.get("key") == b"%PDF-1.7"
+    assert cache.get("missing") is None
+
+
+def test_single_flight_coalesces_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def render():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"%PDF"
+
+    leader = threading.Thread(target=single_flight.do, args=("key", render))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=single_flight.do, args=("key", render)) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while single_flight.stats()["coalesced"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert single_flight.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_post_print_job(client, monkeypatch, tmp_path):
+    monkeypatch.setitem(job_store_global, "store", JobStore(str(tmp_path), 60, 0))
+    job_store_global["store"].start(1, execute_print_job)
+
+    res = client.post(
+        "/api/v1.0/print/jobs",
+        content_type='multipart/form-data',
+        data=get_print_input(),
+        headers=auth_header()
+    )
+    assert res.status_code == 202
+    status_url = res.json["status_url"]
+
+    deadline = time.time() + 60
+    status = res.json
+    while status["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.1)
+        status = client.get(status_url, headers=auth_header()).json
+    assert status["status"] == "done"
+
+    res = client.get(status["result_url"], headers=auth_header())
+    assert res.status_code == 200 and res.get_data().startswith(b"%PDF")
+
+
+def test_post_print_bulk_zip(client):
+    res = client.post(
+        "/api/v1.0/print/bulk",
+        content_type='multipart/form-data',
+        data={"html[]": ["<html><body>first</body></html>", "<html><body>second</body></html>"]},
+        headers=auth_header()
+    )
+    assert res.status_code == 200 and res.mimetype == "application/zip"
+
+    with zipfile.ZipFile(io.BytesIO(res.get_data())) as archive:
+        assert archive.namelist() == ["document-1.pdf", "document-2.pdf"]
+        assert all(archive.read(name).startswith(b"%PDF") for name in archive.namelist())
+
+
+def test_iter_records_reads_ndjson_lazily():
+    def lines():
+        yield b'{"name": "first"}\n'
+        yield b'\n'
+        yield b'{"name": "second"}\n'
+        yield b'not json\n'
+
+    records = iter_records(lines())
+    assert next(records) == {"name": "first"}
+    assert next(records) == {"name": "second"}
+    try:
+        next(records)
+        assert False
+    except BadRequest as e:
+        assert "line 4" in e.description
+
+
+def test_reports_precompiled_into_bytecode_cache(tmp_path, monkeypatch):
+    report_dir = tmp_path / "reports"
+    report_dir.mkdir()
+    (report_dir / "letter.html").write_text("<p>{{ name }}</p>")
+    monkeypatch.setenv("REPORT_BYTECODE_CACHE_DIRECTORY", str(tmp_path / "bytecode"))
+
+    report_app = Flask(__name__, template_folder=str(report_dir))
+    configure_reports(report_app)
+    assert precompile_reports(report_app) == 1
+    assert len(os.listdir(tmp_path / "bytecode")) == 1
+
+    with report_app.app_context():
+        report = render_report_template("letter.html", name="first")
+    assert report.content == "<p>first</p>"
+    assert RenderJob.create(report, None, Template(), False).build_html().content == "<p>first</p>"
+
+
+def test_post_print_streamed_single_document(client, monkeypatch):
+    use_reports(monkeypatch, client, **{"streamed-record.html": "<p>{{ name }}</p>"})
+    res = client.post(
+        "/api/v1.0/print?report=streamed-record.html&single_document=true",
+        content_type="application/x-ndjson",
+        data=b'{"name": "first"}\n{"name": "second"}\n{"name": "third"}\n',
+        headers=auth_header()
+    )
+    assert res.status_code == 200
+    assert get_page_texts(res.get_data()) == ["first", "second", "third"]
+
+
+def test_post_print_wk_data_set_keeps_footer_per_entry(client, monkeypatch):
+    class RecordingRunner:
+        def __init__(self):
+            self.footers = []
+
+        def render(self, source, type_, options=None, verbose=None):
+            self.footers.append(os.path.isfile(options["footer-html"]))
+            return get_image_pdf("white")
+
+    runner = RecordingRunner()
+    monkeypatch.setattr("weasyprint_rest.print.weasyprinter.wk_runner", lambda: runner)
+    use_reports(monkeypatch, client, **{"wk-record.html": "<p>{{ name }}</p>"})
+    options = {"footer-html": "footer.html"}
+    res = post_print(client, {
+        "driver": "wk",
+        "report": "wk-record.html",
+        "data_set": json.dumps([{"name": "first"}, {"name": "second"}, {"name": "third"}]),
+        "options": json.dumps(options),
+        "asset[]": [FileStorage(stream=io.BytesIO(b"<p>Footer</p>"), filename="footer.html",
+                                content_type="text/html")]
+    })
+    assert res.status_code == 200
+    assert runner.footers == [True, True, True]
+
+
+def test_job_store_recovers_queued_jobs(tmp_path):
+    status = JobStore(str(tmp_path), 60, 0).submit({"files": [b"<p>"]}, "http://localhost/")
+
+    store = JobStore(str(tmp_path), 60, 0)
+    store.start(1, lambda job: b"%PDF" + job["files"][0])
+    deadline = time.time() + 5
+    while store.status(status["id"])["status"] != "done" and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert store.status(status["id"])["status"] == "done"
+    with open(store.result_path(status["id"]), "rb") as file:
+        assert file.read() == b"%PDF<p>"
+    assert sorted(os.listdir(str(tmp_path / status["id"]))) == ["result.pdf", "status.json"]
+    assert os.stat(str(tmp_path)).st_mode & 0o777 == 0o700
+
+
+def test_render_job_is_stored_without_pickle():
+    files = []
+    job = RenderJob(
+        html=["<p>ü</p>", b"<p>raw</p>"], styles=[("print.css", "text/css", b"p {}")], template_name="report"
+    )
+    data = json.loads(json.dumps(job.dump(files)))
+
+    loaded = RenderJob.load(data, files)
+    assert loaded.html == ["<p>ü</p>", b"<p>raw</p>"]
+    assert loaded.styles == [("print.css", "text/css", b"p {}")]
+    assert loaded.template_name == "report"
+
+
+def test_admission_rejects_full_queue():
+    controller = AdmissionController(1, 0)
+    controller.acquire()
+    try:
+        controller.acquire()
+        assert False
+    except TooManyRequests as e:
+        assert e.retry_after >= 1
+    controller.release(0.1)
+
+    controller.acquire()
+    assert controller.stats()["rejected"] == 1
+
+
+def test_admission_rejects_missed_deadline():
+    controller = AdmissionController(1, 1)
+    controller.acquire()
+    try:
+        controller.acquire(timeout=0.5)
+        assert False
+    except ServiceUnavailable as e:
+        assert e.retry_after >= 1
+
+
+def test_post_merge_images_in_memory(client):
+    template_dir = get_path("./resources/templates/report")
+    files_before = set(os.listdir(os.getcwd()))
+    cover = read_file(template_dir, "report-cover.jpg")
+    cover_copy = read_file(template_dir, "report-cover.jpg")
+    cover_copy.filename = "cover-copy.jpg"
+    res = client.post(
+        "/api/v1.0/merge",
+        content_type='multipart/form-data',
+        data={
+            "files[]": [cover, cover_copy],
+            "pages": "report-cover.jpg cover-copy.jpg",
+            "image_dpi": "100",
+            "image_quality": "60"
+        },
+        headers=auth_header()
+    )
+    assert res.status_code == 200 and res.get_data().startswith(b"%PDF")
+    assert set(os.listdir(os.getcwd())) == files_before
+
+
+def test_pdf_merge_engine_shares_identical_images():
+    def image_pdf(color):
+        output = io.BytesIO()
+        Image.new("RGB", (200, 100), color).save(output, "PDF")
+        output.seek(0)
+        return output
+
+    merger = PdfMergeEngine()
+    merger.append("first.pdf", image_pdf("red"))
+    merger.append("second.pdf", image_pdf("red"))
+    merger.append("third.pdf", image_pdf("blue"))
+    output = io.BytesIO()
+    merger.write(output, password="secret")
+    merger.close()
+
+    reader = PdfReader(output)
+    assert reader.decrypt("secret")
+    images = [page["/Resources"]["/XObject"].raw_get("/image").idnum for page in reader.pages]
+    assert images[0] == images[1] != images[2]
+
+
+def test_upload_budget_rejects_when_exhausted():
+    budget = UploadBudget(100)
+    assert budget.acquire(150)
+    assert not budget.acquire(1)
+    budget.release(150)
+    assert budget.acquire(60) and budget.acquire(40)
+    assert budget.stats() == {"limit": 100, "in_flight": 100, "rejected": 1}
+
+
+def test_wk_runner_kills_timed_out_process():
+    runner = WkRunner(1, 1)
+    started = time.monotonic()
+    try:
+        runner._run(["sleep", "30"], None)
+        assert False
+    except TimeoutError:
+        pass
+    assert time.monotonic() - started < 10
+    assert runner.stats()["timeouts"] == 1
+
+
+def test_asset_directory_links_template_assets(tmp_path):
+    def asset(name, content):
+        return FileStorage(stream=io.BytesIO(content), filename=name)
+
+    base = Template(assets=[asset("style.css", b"p {}"), asset("img/a.png", b"a"), asset("img/b.png", b"b")])
+    cache = AssetDirectoryCache(str(tmp_path), 1024)
+
+    first = cache.acquire(Template(assets=[asset("img/b.png", b"c")], base_template=base))
+    second = cache.acquire(Template(base_template=base))
+    assert os.path.islink(first + "style.css") and os.path.islink(first + "img/a.png")
+    assert not os.path.islink(first + "img/b.png")
+    with open(first + "img/b.png", "rb") as file:
+        assert file.read() == b"c"
+    with open(second + "img/b.png", "rb") as file:
+        assert file.read() == b"b"
+
+    cache.release(first)
+    cache.release(second)
+    assert not os.path.exists(first)
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "size": 6, "in_use": 0}
+
+
+def test_asset_store_readers_are_independent(tmp_path):
+    paths = []
+    for index, size in enumerate([10, 300 * 1024, 20]):
+        path = tmp_path / "asset{0}".format(index)
+        path.write_bytes(bytes([index]) * size)
+        paths.append(str(path))
+
+    store = AssetStore(2)
+    large = StoredAsset(store, paths[1], "asset1", None)
+    first = large.open()
+    second = large.open()
+    assert first.read(4) == b"\x01" * 4
+    assert len(second.read()) == 300 * 1024
+    assert len(first.read()) == 300 * 1024 - 4
+
+    for path in paths:
+        assert len(StoredAsset(store, path, os.path.basename(path), None).read()) > 0
+    assert store.stats()["open"] == 2
+    first.close()
+    second.close()
+
+
+def test_template_loader_reloads_changed_templates(tmp_path):
+    template_dir = tmp_path / "reload-test"
+    template_dir.mkdir()
+    (template_dir / "style.css").write_text("p { color: red }")
+    loader = TemplateLoader()
+    loader.load(str(tmp_path))
+    template = loader.get("reload-test")
+
+    loader.reload(str(tmp_path))
+    assert loader.get("reload-test") is template
+
+    (template_dir / "style.css").write_text("p { color: blue; }")
+    (tmp_path / "reload-test-added").mkdir()
+    loader.reload(str(tmp_path))
+    assert loader.get("reload-test") is not template
+    assert loader.get("reload-test-added") is not None
+
+
+def test_template_index_is_not_used_after_file_changes(tmp_path):
+    base_dir = tmp_path / "templates"
+    template_dir = base_dir / "index-test"
+    template_dir.mkdir(parents=True)
+    (template_dir / "style.css").write_text("p { color: red }")
+    index_file = str(tmp_path / "index.json")
+    loader = TemplateLoader()
+    loader.load(str(base_dir))
+    loader.save_index(str(base_dir), index_file)
+    assert loader.load_index(str(base_dir), index_file)
+
+    (template_dir / "style.css").write_text("p { color: blue; }")
+    assert not loader.load_index(str(base_dir), index_file)
+
+
+def test_url_fetcher_caches_and_reuses_connections(tmp_path):
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            requests.append(self.path)
+            if self.path == "/slow.css":
+                time.sleep(2)
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = b"p { color: red }"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/css")
+            self.send_header("Content-Length", str(len(body)))
+            if self.path == "/fresh.css":
+                self.send_header("Cache-Control", "max-age=60")
+            else:
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{0}".format(server.server_address[1])
+    try:
+        fetcher = UrlFetcher(ConnectionPool(2), HttpCache(1024, str(tmp_path), 4096), 5, 2)
+        for _ in range(2):
+            assert fetcher.fetch(base_url + "/fresh.css")["string"] == b"p { color: red }"
+            assert fetcher.fetch(base_url + "/etag.css")["mime_type"] == "text/css"
+        assert requests == ["/fresh.css", "/etag.css", "/etag.css"]
+        assert fetcher.stats()["connections"]["opened"] == 1
+        assert fetcher.stats()["cache"]["revalidated"] == 1
+
+        try:
+            fetcher.fetch(base_url + "/slow.css", FetchBudget(1, 0))
+            assert False
+        except TimeoutError:
+            pass
+    finally:
+        server.shutdown()
+
+
+def test_url_fetcher_limits_decompressed_size():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/bomb.css":
+                body, encoding = gzip.compress(b" " * 8 * 1024 * 1024), "gzip"
+            else:
+                compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+                body, encoding = compressor.compress(b"p { color: red }") + compressor.flush(), "deflate"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/css")
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{0}".format(server.server_address[1])
+    try:
+        fetcher = UrlFetcher(ConnectionPool(2), HttpCache(1024, None, 0), 5, 0)
+        assert fetcher.fetch(base_url + "/raw.css", FetchBudget(5, 1024))["string"] == b"p { color: red }"
+        try:
+            fetcher.fetch(base_url + "/bomb.css", FetchBudget(5, 1024 * 1024))
+            assert False
+        except ValueError:
+            pass
+    finally:
+        server.shutdown()
+
+
+def test_url_fetcher_prefetches_only_resources():
+    html = b'''<html><head><link rel="stylesheet" href="http://127.0.0.1:1/style.css">
+        <link rel="canonical" href="http://127.0.0.1:1/canonical"></head>
+        <body style="background: url('http://127.0.0.1:1/background.png')"><a href="http://127.0.0.1:1/delete">a</a>
+        <img alt="logo" src="http://127.0.0.1:1/logo.png"></body></html>'''
+    budget = FetchBudget(5, 0)
+    UrlFetcher(ConnectionPool(1), HttpCache(1024, None, 0), 1, 1, 1).prefetch(html, budget)
+    budget.close()
+    assert len(budget.prefetched) <= 3 and sorted(list(budget.prefetched) + list(budget.pending)) == [
+        "http://127.0.0.1:1/background.png", "http://127.0.0.1:1/logo.png", "http://127.0.0.1:1/style.css"
+    ]
+    try:
+        budget.remaining()
+        assert False
+    except TimeoutError:
+        pass
+
+
+def test_url_fetcher_fetches_queued_prefetch_itself():
+    fetcher = UrlFetcher(ConnectionPool(1), HttpCache(1024, None, 0), 1, 1)
+    blocked = threading.Event()
+    fetcher.executor.submit(blocked.wait)
+    budget = FetchBudget(2, 0)
+    try:
+        fetcher.prefetch(b'<img src="http://127.0.0.1:1/logo.png">', budget)
+        try:
+            fetcher.fetch("http://127.0.0.1:1/logo.png", budget)
+            assert False
+        except ConnectionRefusedError:
+            pass
+    finally:
+        blocked.set()
+        budget.close()
+
+
+def test_url_policy_rules_before_patterns():
+    policy = compile_policy("^https://allowed.org/.*$", "^.*$", json.dumps([
+        {"action": "block", "cidr": "127.0.0.0/8"},
+        {"action": "allow", "scheme": "https", "host": "*.cdn.org"},
+        {"action": "allow", "prefix": "http://example.org/public/"}
+    ]), 16)
+    assert not policy.allows("http://127.0.0.1/image.png")
+    assert policy.allows("https://fonts.cdn.org/font.woff")
+    assert not policy.allows("http://fonts.cdn.org/font.woff")
+    assert policy.allows("http://example.org/public/image.png")
+    assert policy.allows("https://allowed.org/image.png")
+    assert not policy.allows("https://example.org/image.png")
+    assert policy.allows("https://fonts.cdn.org/font.woff")
+    # Only the address literal is decided without resolving a host name for the cidr rule
+    assert policy.stats() == {"rules": 3, "hits": 0, "misses": 7, "entries": 1}
+
+
+def test_url_policy_checks_resolved_addresses_every_time():
+    policy = compile_policy("^.*$", "^$", json.dumps([{"action": "block", "cidr": "10.0.0.0/8"}]), 16)
+    assert policy.allows("http://localhost/image.png")
+    assert not policy.allows("http://localhost/image.png", "10.0.0.1")
+    assert not policy.allows("http://10.0.0.1/image.png")
+    assert policy.allows("http://localhost/image.png")
+    assert policy.stats()["entries"] == 1
+
+
+def post_print(client, data=None, headers=None):
+    return client.post(
+        "/api/v1.0/print",
+        content_type='multipart/form-data',
+        data=data if data is not None else get_print_input(),
+        headers={**auth_header(), **(headers or {})}
+    )
+
+
+def use_reports(monkeypatch, client, **reports):
+    monkeypatch.setattr(client.application, "jinja_loader", DictLoader(reports))
+
+
+def get_page_texts(pdf_bytes):
+    return [page.extract_text().strip() for page in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+
+def get_image_pdf(color):
+    output = io.BytesIO()
+    Image.new("RGB", (10, 10), color).save(output, "PDF")
+    return output.getvalue()
+
+
+def get_health(client):
+    return client.get("/api/v1.0/health", headers=auth_header()).json
+
+
 def get_print_input(use_template=True):
     input_dir = get_path("./resources/report")
     template_dir = get_path("./resources/templates/report")
@@ -1,14 +1,26 @@
 import logging
+import threading
 
 from flask import Flask
 from flask_restful import Api
 from flask_cors import CORS
 
+from .web.rest.jobs import execute_print_job
 from .web.routes import register_routes
+from .web.uploads import register_upload_handling
+from .print.font_registry import install_subset_cache
+from .print.job_store import start_job_store
+from .print.render_pool import start_render_pool
+from .print.reports import configure_reports, precompile_reports
 from .print.template_loader import TemplateLoader
+from .print.wk_runner import wk_runner
 from .env import (
     get_max_upload_size, get_template_directory, is_debug_mode, get_report_directory,
-    get_secret_key, is_cors_enabled, get_cors_origins, get_valid_file_ext
+    get_secret_key, is_cors_enabled, get_cors_origins, get_valid_file_ext,
+    get_render_workers, get_render_worker_queue_depth, get_render_worker_max_renders,
+    get_job_workers, get_job_directory, get_job_result_ttl, get_job_max_pending, get_job_callback_url,
+    get_job_callback_timeout, get_template_reload_interval, get_template_index_file, is_template_prewarm_enabled,
+    is_template_prewarm_render_enabled, is_report_precompile_enabled
 )
 
 _global = {
@@ -29,11 +41,37 @@ def create_app():
     local_app.config['MAIL_ENABLED'] = False
     local_app.config['SECRET_KEY'] = get_secret_key()
     local_app.config['UPLOAD_EXTENSIONS'] = get_valid_file_ext()
+    configure_reports(local_app)
 
+    register_upload_handling(local_app)
     local_api = Api(local_app)
 
     register_routes(local_api)
-    TemplateLoader().load(get_template_directory())
+    install_subset_cache()
+    # The health service reports the wkhtmltopdf version detected in the background
+    wk_runner().version()
+    _load_templates()
+    if is_report_precompile_enabled():
+        precompile_reports(local_app)
+
+    if get_render_workers() > 0:
+        start_render_pool(
+            get_render_workers(),
+            get_render_worker_queue_depth(),
+            get_render_worker_max_renders(),
+            get_template_directory()
+        )
+
+    if get_job_workers() > 0:
+        start_job_store(
+            get_job_directory(),
+            get_job_workers(),
+            get_job_result_ttl(),
+            get_job_max_pending(),
+            get_job_callback_url(),
+            get_job_callback_timeout(),
+            execute_print_job
+        )
 
     weasyprint_logger = logging.getLogger("weasyprint")
     if is_debug_mode():
@@ -43,6 +81,27 @@ def create_app():
     _global["api"] = local_api
 
 
+def _load_templates():
+    loader = TemplateLoader()
+    index_file = get_template_index_file()
+    if index_file is None or not loader.load_index(get_template_directory(), index_file):
+        loader.load(get_template_directory())
+        if index_file is not None:
+            try:
+                loader.save_index(get_template_directory(), index_file)
+            except OSError:
+                logging.exception("Template index %r could not be written" % index_file)
+
+    if is_template_prewarm_enabled():
+        loader.ready.clear()
+        threading.Thread(
+            target=loader.prewarm, args=(is_template_prewarm_render_enabled(),), name="template-prewarm", daemon=True
+        ).start()
+
+    if get_template_reload_interval() > 0:
+        loader.watch(get_template_directory(), get_template_reload_interval())
+
+
 def app():
     if _global["app"] is None:  # pragma: no cover
         create_app()
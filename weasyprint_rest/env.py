@@ -1,10 +1,25 @@
 import os
+import tempfile
+
+
+_parsed = {}
 
 
 def get(key, default=None):
     return os.environ.get(key) or default
 
 
+def get_parsed(key, default, parse):
+    # Getters used for every request or resource only parse a value again once it was changed
+    raw = os.environ.get(key)
+    cached = _parsed.get(key)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    value = parse(raw or default)
+    _parsed[key] = (raw, value)
+    return value
+
+
 def is_true(value):
     return isinstance(value, str) and value.lower() in ['true', '1', 't', 'y', 'yes', 'enabled', '¯\\_(ツ)_/¯']
 
@@ -22,7 +37,7 @@ def get_allowed_url_pattern():
 
 
 def get_max_upload_size():
-    return int(get("MAX_UPLOAD_SIZE", 100 * 1024 * 1024))
+    return get_parsed("MAX_UPLOAD_SIZE", 100 * 1024 * 1024, int)
 
 
 def get_secret_key():
@@ -30,7 +45,7 @@ def get_secret_key():
 
 
 def is_debug_mode():
-    return is_true(get("ENABLE_DEBUG_MODE"))
+    return get_parsed("ENABLE_DEBUG_MODE", None, is_true)
 
 
 def is_cors_enabled():
@@ -51,3 +66,219 @@ def get_report_directory():
 
 def get_valid_file_ext():
     return get("UPLOAD_EXTENSIONS", '.png,.jpg,.jpeg,.tiff,.bmp,.gif,.pdf').split(",")
+
+
+def get_render_workers():
+    return int(get("RENDER_WORKERS", 0))
+
+
+def get_render_worker_queue_depth():
+    return int(get("RENDER_WORKER_QUEUE_DEPTH", 2))
+
+
+def get_render_worker_max_renders():
+    return int(get("RENDER_WORKER_MAX_RENDERS", 500))
+
+
+def get_batch_parallelism():
+    return int(get("BATCH_PARALLELISM", 0))
+
+
+def get_bulk_max_documents():
+    return int(get("BULK_MAX_DOCUMENTS", 1000))
+
+
+def get_stylesheet_cache_size():
+    return int(get("STYLESHEET_CACHE_SIZE", 16 * 1024 * 1024))
+
+
+def get_font_registry_size():
+    return int(get("FONT_REGISTRY_SIZE", 64))
+
+
+def get_font_subset_cache_size():
+    return int(get("FONT_SUBSET_CACHE_SIZE", 64 * 1024 * 1024))
+
+
+def get_image_cache_template_size():
+    return int(get("IMAGE_CACHE_TEMPLATE_SIZE", 64 * 1024 * 1024))
+
+
+def get_image_cache_request_size():
+    return int(get("IMAGE_CACHE_REQUEST_SIZE", 16 * 1024 * 1024))
+
+
+def is_result_cache_enabled():
+    return is_true(get("RESULT_CACHE_ENABLED"))
+
+
+def get_result_cache_memory_size():
+    return int(get("RESULT_CACHE_MEMORY_SIZE", 64 * 1024 * 1024))
+
+
+def get_result_cache_directory():
+    return get("RESULT_CACHE_DIRECTORY")
+
+
+def get_result_cache_disk_size():
+    return int(get("RESULT_CACHE_DISK_SIZE", 1024 * 1024 * 1024))
+
+
+def get_result_cache_ttl():
+    return int(get("RESULT_CACHE_TTL", 3600))
+
+
+def get_job_workers():
+    return int(get("JOB_WORKERS", 0))
+
+
+def get_job_directory():
+    return get("JOB_DIRECTORY", os.path.join(tempfile.gettempdir(), "easy-pdf-rest-jobs"))
+
+
+def get_job_result_ttl():
+    return int(get("JOB_RESULT_TTL", 3600))
+
+
+def get_job_max_pending():
+    return int(get("JOB_MAX_PENDING", 100))
+
+
+def get_job_callback_url():
+    return get("JOB_CALLBACK_URL")
+
+
+def get_job_callback_timeout():
+    return int(get("JOB_CALLBACK_TIMEOUT", 10))
+
+
+def get_admission_concurrency():
+    return int(get("ADMISSION_CONCURRENCY", 0))
+
+
+def get_admission_queue_size():
+    return int(get("ADMISSION_QUEUE_SIZE", 16))
+
+
+def get_admission_default_timeout():
+    return float(get("ADMISSION_DEFAULT_TIMEOUT", 0))
+
+
+def get_response_spool_size():
+    return get_parsed("RESPONSE_SPOOL_SIZE", 8 * 1024 * 1024, int)
+
+
+def get_upload_spool_size():
+    return get_parsed("UPLOAD_SPOOL_SIZE", 512 * 1024, int)
+
+
+def get_upload_request_memory():
+    return get_parsed("UPLOAD_REQUEST_MEMORY", 8 * 1024 * 1024, int)
+
+
+def get_upload_in_flight_limit():
+    return int(get("UPLOAD_IN_FLIGHT_LIMIT", 0))
+
+
+def get_merge_image_workers():
+    return int(get("MERGE_IMAGE_WORKERS", 4))
+
+
+def get_wk_concurrency():
+    return int(get("WK_CONCURRENCY", os.cpu_count() or 1))
+
+
+def get_wk_timeout():
+    return int(get("WK_TIMEOUT", 120))
+
+
+def get_wk_batch_size():
+    return int(get("WK_BATCH_SIZE", 1))
+
+
+def get_asset_directory():
+    return get("ASSET_DIRECTORY", os.path.join(tempfile.gettempdir(), "easy-pdf-rest-assets"))
+
+
+def get_asset_directory_size():
+    return int(get("ASSET_DIRECTORY_SIZE", 256 * 1024 * 1024))
+
+
+def get_asset_store_max_open():
+    return int(get("ASSET_STORE_MAX_OPEN", 256))
+
+
+def get_template_reload_interval():
+    return int(get("TEMPLATE_RELOAD_INTERVAL", 0))
+
+
+def is_template_prewarm_enabled():
+    return is_true(get("TEMPLATE_PREWARM", "false"))
+
+
+def is_template_prewarm_render_enabled():
+    return is_true(get("TEMPLATE_PREWARM_RENDER", "false"))
+
+
+def get_template_index_file():
+    return get("TEMPLATE_INDEX_FILE")
+
+
+def get_report_cache_size():
+    return int(get("REPORT_CACHE_SIZE", 400))
+
+
+def get_report_bytecode_cache_directory():
+    return get("REPORT_BYTECODE_CACHE_DIRECTORY")
+
+
+def is_report_auto_reload_enabled():
+    return is_true(get("REPORT_AUTO_RELOAD", "true"))
+
+
+def is_report_precompile_enabled():
+    return is_true(get("REPORT_PRECOMPILE", "true"))
+
+
+def get_url_fetch_timeout():
+    return get_parsed("URL_FETCH_TIMEOUT", 10, int)
+
+
+def get_url_fetch_render_timeout():
+    return get_parsed("URL_FETCH_RENDER_TIMEOUT", 60, int)
+
+
+def get_url_fetch_max_bytes():
+    return get_parsed("URL_FETCH_MAX_BYTES", 50 * 1024 * 1024, int)
+
+
+def get_url_fetch_pool_size():
+    return int(get("URL_FETCH_POOL_SIZE", 4))
+
+
+def get_url_prefetch_workers():
+    return int(get("URL_PREFETCH_WORKERS", 4))
+
+
+def get_url_prefetch_slots():
+    return int(get("URL_PREFETCH_SLOTS", 2))
+
+
+def get_url_cache_memory_size():
+    return int(get("URL_CACHE_MEMORY_SIZE", 32 * 1024 * 1024))
+
+
+def get_url_cache_directory():
+    return get("URL_CACHE_DIRECTORY")
+
+
+def get_url_cache_disk_size():
+    return int(get("URL_CACHE_DISK_SIZE", 256 * 1024 * 1024))
+
+
+def get_url_access_rules():
+    return get("URL_ACCESS_RULES")
+
+
+def get_url_policy_cache_size():
+    return int(get("URL_POLICY_CACHE_SIZE", 4096))
@@ -0,0 +1,177 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ..env import get_asset_directory, get_asset_directory_size
+
+TEMPLATE_PREFIX = "template-"
+REQUEST_PREFIX = "request-"
+PARTIAL_PREFIX = ".partial-"
+# Seconds after which leftovers of requests and interrupted writes are removed on startup
+STALE_AGE = 3600
+
+_global = {
+    "cache": None
+}
+
+
+def _directory_size(directory):
+    size = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            size += os.lstat(os.path.join(root, file)).st_size
+    return size
+
+
+def _overlay(source_dir, target_dir, names):
+    # Entries the request does not replace are linked as a whole, only directories it writes into are descended
+    nested = {}
+    for name in names:
+        head, _, tail = name.partition("/")
+        if tail:
+            nested.setdefault(head, []).append(tail)
+
+    for entry in os.listdir(source_dir):
+        source = os.path.join(source_dir, entry)
+        target = os.path.join(target_dir, entry)
+        if entry in nested and os.path.isdir(source):
+            os.makedirs(target)
+            _overlay(source, target, nested[entry])
+        elif entry not in names:
+            os.symlink(source, target)
+
+
+class AssetDirectoryCache:
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self.entries = OrderedDict()
+        self.in_use = {}
+        self.requests = {}
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_directory()
+
+    def acquire(self, template):
+        # A thin directory per request, template assets are links into the shared, content addressed copy
+        request_dir = os.path.join(self.directory, REQUEST_PREFIX + uuid.uuid4().hex)
+        os.makedirs(request_dir)
+
+        key = self._publish(template.base_template) if template.base_template is not None else None
+        with self.lock:
+            self.requests[request_dir] = key
+
+        try:
+            if key is not None:
+                names = [os.path.normpath(name) for name in template.assets]
+                _overlay(os.path.join(self.directory, TEMPLATE_PREFIX + key), request_dir, names)
+
+            for name in template.assets:
+                path = os.path.join(request_dir, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                template.save_asset(name, path)
+        except BaseException:
+            self.release(request_dir)
+            raise
+
+        return request_dir + "/"
+
+    def release(self, request_dir):
+        request_dir = request_dir.rstrip("/")
+        shutil.rmtree(request_dir, ignore_errors=True)
+        with self.lock:
+            key = self.requests.pop(request_dir, None)
+            if key is not None:
+                self._unuse(key)
+                self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size": self.total_size,
+                "in_use": len(self.requests)
+            }
+
+    def _publish(self, template):
+        key = template.get_asset_signature()
+        path = os.path.join(self.directory, TEMPLATE_PREFIX + key)
+        with self.lock:
+            # Marked as used before it exists, so a concurrent eviction can not remove it while it is linked
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return key
+            self.misses += 1
+
+        if not os.path.isdir(path):
+            # Written aside and renamed, so other requests never see a partially written directory
+            partial = os.path.join(self.directory, PARTIAL_PREFIX + uuid.uuid4().hex)
+            try:
+                for name in template.assets:
+                    file = os.path.join(partial, name)
+                    os.makedirs(os.path.dirname(file), exist_ok=True)
+                    template.save_asset(name, file)
+                os.makedirs(partial, exist_ok=True)
+                os.rename(partial, path)
+            except OSError:
+                shutil.rmtree(partial, ignore_errors=True)
+                if not os.path.isdir(path):
+                    with self.lock:
+                        self._unuse(key)
+                    raise
+
+        size = _directory_size(path)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = size
+                self.total_size += size
+            self._evict()
+        return key
+
+    def _unuse(self, key):
+        self.in_use[key] -= 1
+        if self.in_use[key] == 0:
+            del self.in_use[key]
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.total_size <= self.size:
+                break
+            if key in self.in_use:
+                continue
+            self.total_size -= self.entries.pop(key)
+            shutil.rmtree(os.path.join(self.directory, TEMPLATE_PREFIX + key), ignore_errors=True)
+
+    def _index_directory(self):
+        entries = []
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if entry.startswith(TEMPLATE_PREFIX):
+                entries.append((os.path.getmtime(path), entry[len(TEMPLATE_PREFIX):], _directory_size(path)))
+            elif entry.startswith((REQUEST_PREFIX, PARTIAL_PREFIX)) and \
+                    time.time() - os.path.getmtime(path) > STALE_AGE:
+                logging.debug("Removing stale asset directory %r", path)
+                shutil.rmtree(path, ignore_errors=True)
+
+        for _, key, size in sorted(entries):
+            self.entries[key] = size
+            self.total_size += size
+        with self.lock:
+            self._evict()
+
+
+def asset_directories():
+    if _global["cache"] is None:
+        _global["cache"] = AssetDirectoryCache(get_asset_directory(), get_asset_directory_size())
+    return _global["cache"]
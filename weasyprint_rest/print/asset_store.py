@@ -0,0 +1,161 @@
+import io
+import mmap
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from ..env import get_asset_store_max_open, get_template_reload_interval
+
+# Files up to this size are kept as bytes, larger ones are memory mapped
+MMAP_THRESHOLD = 256 * 1024
+
+_global = {
+    "store": None
+}
+
+
+class MappedStream(io.RawIOBase):
+    # Every reader has its own position on the shared, read only content
+    def __init__(self, content):
+        super(MappedStream, self).__init__()
+        self.view = memoryview(content)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.view) - self.position)
+        if size <= 0:
+            return 0
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def readall(self):
+        content = self.view[self.position:].tobytes()
+        self.position = len(self.view)
+        return content
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.view.release()
+        super(MappedStream, self).close()
+
+
+class AssetStore:
+    def __init__(self, max_open, map_files=True):
+        self.max_open = max_open
+        self.map_files = map_files
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        return MappedStream(self.content(path))
+
+    def content(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            content = self.entries.get(path)
+            if content is not None and content[0] == key:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return _view(content[1])
+            self.misses += 1
+
+        content = self._load(path, stat.st_size, self.map_files)
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            self.entries[path] = (key, content)
+            # A map is only read through views taken while it is listed, so a closed map is never handed out
+            view = _view(content)
+            evicted = [previous] if previous is not None else []
+            while len(self.entries) > self.max_open:
+                evicted.append(self.entries.popitem(last=False)[1])
+        for entry in evicted:
+            _close(entry[1])
+        return view
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "open": len(self.entries),
+                "mapped": sum(1 for _, content in self.entries.values() if isinstance(content, mmap.mmap))
+            }
+
+    @staticmethod
+    def _load(path, size, map_files):
+        with open(path, "rb") as file:
+            if size <= MMAP_THRESHOLD or not map_files:
+                return file.read()
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _view(content):
+    return memoryview(content) if isinstance(content, mmap.mmap) else content
+
+
+def _close(content):
+    if not isinstance(content, mmap.mmap):
+        return
+    try:
+        content.close()
+    except BufferError:
+        # Still read by a request, the map is closed once its last reader is gone
+        pass
+
+
+class StoredAsset:
+    # Template file opened on first use, every reader gets its own stream
+    name = None
+
+    def __init__(self, store, path, filename, content_type):
+        self.store = store
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+
+    @property
+    def mimetype(self):
+        return self.content_type.split(";")[0].strip().lower() if self.content_type else None
+
+    def open(self):
+        return self.store.open(self.path)
+
+    def read(self):
+        content = self.store.content(self.path)
+        return content if isinstance(content, bytes) else content.tobytes()
+
+    def save(self, destination):
+        with self.open() as stream, open(destination, "wb") as file:
+            shutil.copyfileobj(stream, file)
+
+    def __repr__(self):
+        return "<StoredAsset: %r (%r)>" % (self.filename, self.content_type)
+
+
+def asset_store():
+    if _global["store"] is None:
+        # A mapped file rewritten in place fails its readers, files which may be reloaded are read as a copy
+        _global["store"] = AssetStore(get_asset_store_max_open(), map_files=get_template_reload_interval() == 0)
+    return _global["store"]
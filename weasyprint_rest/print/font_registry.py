@@ -0,0 +1,137 @@
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+
+from weasyprint.pdf.stream import Font
+from weasyprint.text.fonts import FontConfiguration
+
+from ..env import get_font_registry_size, get_font_subset_cache_size
+
+FONT_EXTENSIONS = ('.otf', '.ttf', '.woff', '.woff2')
+
+_global = {
+    "registry": None,
+    "subset_cache": None
+}
+
+
+class FontRegistry:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = itertools.count()
+
+    def get(self, signature):
+        with self.lock:
+            if signature in self.entries:
+                self.entries.move_to_end(signature)
+                self.hits += 1
+                return self.entries[signature]
+            self.misses += 1
+
+            font_config = self.create()
+            if self.max_entries > 0:
+                self.entries[signature] = font_config
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return font_config
+
+    def create(self):
+        font_config = FontConfiguration()
+        # Identifies the font configuration in caches of objects that registered fonts in it
+        font_config.registry_key = next(self.generation)
+        font_config.lock = threading.Lock()
+        return font_config
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries)
+            }
+
+
+class SubsetCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, content):
+        if len(content) > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size": self.size
+            }
+
+
+_clean_font = Font.clean
+
+
+def _clean_font_cached(font, cmap, hinting):
+    # Only plain subsetting is cached, variable and color fonts are rewritten further
+    if font.ttfont is None or not cmap or font.png or font.svg or 'fvar' in font.ttfont:
+        return _clean_font(font, cmap, hinting)
+
+    cache = subset_cache()
+    key = (hashlib.sha256(font.file_content).digest(), font.index, tuple(sorted(cmap)), hinting)
+    content = cache.get(key)
+    if content is not None:
+        font.file_content = content
+        return
+
+    _clean_font(font, cmap, hinting)
+    cache.put(key, font.file_content)
+
+
+def install_subset_cache():
+    if get_font_subset_cache_size() > 0:
+        Font.clean = _clean_font_cached
+
+
+def is_font_file(filename):
+    return filename is not None and filename.lower().endswith(FONT_EXTENSIONS)
+
+
+def font_registry():
+    if _global["registry"] is None:
+        _global["registry"] = FontRegistry(get_font_registry_size())
+    return _global["registry"]
+
+
+def subset_cache():
+    if _global["subset_cache"] is None:
+        _global["subset_cache"] = SubsetCache(get_font_subset_cache_size())
+    return _global["subset_cache"]
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+from weasyprint.images import LazyImage, RasterImage
+
+from ..env import get_image_cache_template_size, get_image_cache_request_size
+
+# Only content addressed resources are shared, remote resources may change between requests
+SHARED_URL_PREFIXES = ("file:", "data:")
+
+_global = {
+    "template": None,
+    "request": None
+}
+
+
+class ImageCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, image, size):
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (image, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size": self.size
+            }
+
+
+# Image cache of a single render, entries it uses are kept in the view so evictions never affect it
+class ImageCacheView(dict):
+    def __init__(self, cache, namespace):
+        super().__init__()
+        self.cache = cache
+        self.namespace = namespace
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        if not _is_shared(key):
+            return False
+
+        image = self.cache.get((self.namespace, key))
+        if image is None:
+            return False
+        dict.__setitem__(self, key, image)
+        return True
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        if _is_shared(key) and isinstance(value, RasterImage):
+            size = _detach(value)
+            if size is not None:
+                self.cache.put((self.namespace, key), value, size + len(key))
+
+
+def _is_shared(key):
+    return isinstance(key, str) and key.startswith(SHARED_URL_PREFIXES)
+
+
+def _detach(image):
+    # Decoded data lives in the cache of the render that created the image, move it into the image itself
+    lazy_image = image.image_data
+    if image._dpi or not isinstance(lazy_image, LazyImage):
+        return None
+
+    data = lazy_image.data
+    lazy_image._cache = image._cache = {lazy_image._key: data}
+    return len(data)
+
+
+def template_image_cache():
+    if _global["template"] is None:
+        _global["template"] = ImageCache(get_image_cache_template_size())
+    return _global["template"]
+
+
+def request_image_cache():
+    if _global["request"] is None:
+        _global["request"] = ImageCache(get_image_cache_request_size())
+    return _global["request"]
+
+
+def image_cache_view(template, optimize_images):
+    cache = request_image_cache() if template.assets else template_image_cache()
+    return ImageCacheView(cache, (template.get_asset_signature(), bool(optimize_images)))
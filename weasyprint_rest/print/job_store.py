@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+JOB_ID_RE = re.compile('^[0-9a-f]{32}$')
+EXPIRE_INTERVAL = 60
+
+_global = {
+    "store": None
+}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobDirectoryError(Exception):
+    pass
+
+
+def _write_atomic(path, content):
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+        file.write(content)
+    os.replace(file.name, path)
+
+
+class JobStore:
+    def __init__(self, directory, result_ttl, max_pending, callback_url=None, callback_timeout=10):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        self.callback_url = callback_url
+        self.callback_timeout = callback_timeout
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.last_expire = 0
+        self.threads = []
+
+        # Jobs hold documents and passwords, only this process may read them or plant new ones
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if os.stat(self.directory).st_uid != os.getuid():
+            raise JobDirectoryError("Job directory %r is not owned by this process" % self.directory)
+        os.chmod(self.directory, 0o700)
+
+    def submit(self, job, base_url, callback_url=None, attributes=None):
+        if 0 < self.max_pending <= self.queue.qsize():
+            raise QueueFullError("Too many print jobs are waiting")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id), mode=0o700)
+        files = job.get("files", [])
+        for index, content in enumerate(files):
+            _write_atomic(self._path(job_id, "file-%d" % index), content)
+        _write_atomic(self._path(job_id, "job.json"), json.dumps(dict(job, files=len(files))).encode())
+        status = {
+            "id": job_id,
+            "status": "queued",
+            "created": round(time.time() * 1000),
+            "base_url": base_url,
+            "callback_url": callback_url or self.callback_url,
+            **(attributes or {})
+        }
+        self._write_status(job_id, status)
+        self.queue.put(job_id)
+        return status
+
+    def status(self, job_id):
+        if not JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id, "status.json")) as file:
+                status = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if status.get("expires") is not None and status["expires"] <= time.time() * 1000:
+            return None
+        return status
+
+    def result_path(self, job_id):
+        return self._path(job_id, "result.pdf")
+
+    def start(self, workers, execute):
+        self._recover()
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work, args=(execute,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "workers": len(self.threads)
+        }
+
+    def _work(self, execute):
+        while True:
+            try:
+                job_id = self.queue.get(timeout=EXPIRE_INTERVAL)
+            except queue.Empty:
+                self._expire()
+                continue
+
+            try:
+                self._run(job_id, execute)
+            except Exception:  # pragma: no cover
+                logging.exception("Could not run print job %r" % job_id)
+            self._expire()
+
+    def _run(self, job_id, execute):
+        status = self.status(job_id)
+        if status is None:  # pragma: no cover
+            return
+
+        status.update(status="running", started=round(time.time() * 1000))
+        self._write_status(job_id, status)
+
+        try:
+            _write_atomic(self.result_path(job_id), execute(self._read_job(job_id)))
+            status.update(status="done")
+        except Exception as e:
+            logging.exception("Print job %r failed" % job_id)
+            status.update(status="failed", error=str(e))
+
+        finished = round(time.time() * 1000)
+        status.update(finished=finished, expires=finished + self.result_ttl * 1000)
+        self._write_status(job_id, status)
+        self._remove_job(job_id)
+
+        if status.get("callback_url"):
+            self._notify(status)
+
+    def _read_job(self, job_id):
+        with open(self._path(job_id, "job.json")) as file:
+            job = json.load(file)
+        files = []
+        for index in range(job["files"]):
+            with open(self._path(job_id, "file-%d" % index), "rb") as file:
+                files.append(file.read())
+        job["files"] = files
+        return job
+
+    def _remove_job(self, job_id):
+        for name in os.listdir(self._path(job_id)):
+            if name == "job.json" or name.startswith("file-"):
+                os.remove(self._path(job_id, name))
+
+    def _notify(self, status):
+        body = json.dumps(public_status(status)).encode()
+        callback = urllib.request.Request(
+            status["callback_url"], data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(callback, timeout=self.callback_timeout):
+                pass
+        except Exception as e:
+            logging.warning("Callback of print job %r failed: %s" % (status["id"], e))
+
+    def _recover(self):
+        # Jobs interrupted by a restart are queued again in the order they were submitted
+        statuses = [self.status(job_id) for job_id in os.listdir(self.directory)]
+        for status in sorted(filter(None, statuses), key=lambda s: s["created"]):
+            if status["status"] in ("queued", "running"):
+                status.update(status="queued")
+                self._write_status(status["id"], status)
+                self.queue.put(status["id"])
+
+    def _expire(self):
+        with self.lock:
+            if time.time() - self.last_expire < EXPIRE_INTERVAL:
+                return
+            self.last_expire = time.time()
+
+        # Directories of jobs being submitted have no status yet
+        cutoff = self.last_expire - EXPIRE_INTERVAL
+        for job_id in os.listdir(self.directory):
+            if not JOB_ID_RE.match(job_id) or os.path.getmtime(self._path(job_id)) > cutoff:
+                continue
+            if self.status(job_id) is None:
+                shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    def _write_status(self, job_id, status):
+        _write_atomic(self._path(job_id, "status.json"), json.dumps(status).encode())
+
+    def _path(self, job_id, *names):
+        return os.path.join(self.directory, job_id, *names)
+
+
+def public_status(status):
+    result = {key: value for key, value in status.items() if key not in ("base_url", "callback_url")}
+    result["status_url"] = "%sapi/v1.0/print/jobs/%s" % (status["base_url"], status["id"])
+    if status["status"] == "done":
+        result["result_url"] = result["status_url"] + "/result"
+    return result
+
+
+def start_job_store(directory, workers, result_ttl, max_pending, callback_url, callback_timeout, execute):
+    if _global["store"] is None:
+        _global["store"] = JobStore(directory, result_ttl, max_pending, callback_url, callback_timeout)
+        _global["store"].start(workers, execute)
+    return _global["store"]
+
+
+def job_store():
+    return _global["store"]
@@ -0,0 +1,117 @@
+import hashlib
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+FONT_FILE_KEYS = ("/FontFile", "/FontFile2", "/FontFile3")
+# Nesting up to which referenced objects are compared, deeper objects are never shared
+MAX_DIGEST_DEPTH = 8
+
+
+def _digest(value, depth=0):
+    if depth > MAX_DIGEST_DEPTH:
+        return None
+
+    if isinstance(value, IndirectObject):
+        value = value.get_object()
+
+    if isinstance(value, DictionaryObject):
+        parts = [type(value).__name__.encode()]
+        if isinstance(value, StreamObject):
+            parts.append(hashlib.sha256(value._data).digest())
+        for key in sorted(value.keys()):
+            if key == "/Length":
+                continue
+            item = _digest(value.raw_get(key), depth + 1)
+            if item is None:
+                return None
+            parts.append(key.encode() + item)
+    elif isinstance(value, ArrayObject):
+        parts = [b"array"]
+        for item in value:
+            item = _digest(item, depth + 1)
+            if item is None:
+                return None
+            parts.append(item)
+    else:
+        parts = [type(value).__name__.encode(), repr(value).encode()]
+
+    return hashlib.sha256(b"\0".join(parts)).digest()
+
+
+def _resource_streams(resources, found, depth=0):
+    # Images and embedded font files are the objects identical inputs usually have in common
+    resources = resources.get_object() if resources is not None else None
+    if not isinstance(resources, DictionaryObject) or depth > MAX_DIGEST_DEPTH:
+        return
+
+    xobjects = resources.get("/XObject")
+    for reference in (xobjects.get_object().values() if xobjects is not None else []):
+        if not isinstance(reference, IndirectObject):
+            continue
+        xobject = reference.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            found[reference.idnum] = reference
+        elif xobject.get("/Subtype") == "/Form":
+            _resource_streams(xobject.get("/Resources"), found, depth + 1)
+
+    fonts = resources.get("/Font")
+    for font in (fonts.get_object().values() if fonts is not None else []):
+        font = font.get_object()
+        for descendant in [font] + list(font.get("/DescendantFonts", [])):
+            descriptor = descendant.get_object().get("/FontDescriptor")
+            if descriptor is None:
+                continue
+            for key in FONT_FILE_KEYS:
+                reference = descriptor.get_object().raw_get(key) if key in descriptor.get_object() else None
+                if isinstance(reference, IndirectObject):
+                    found[reference.idnum] = reference
+
+
+class PdfMergeEngine:
+    def __init__(self):
+        self.writer = PdfWriter()
+        self.readers = {}
+        self.shared = {}
+
+    def append(self, name, source, pages=None):
+        reader = self.readers.get(name)
+        if reader is None:
+            reader = self.readers[name] = PdfReader(source)
+
+        indices = range(*pages.indices(len(reader.pages))) if pages is not None else range(len(reader.pages))
+        streams = {}
+        for index in indices:
+            _resource_streams(reader.pages[index].get("/Resources"), streams)
+        digests = {idnum: _digest(reference) for idnum, reference in streams.items()}
+
+        # Objects equal to ones copied from other inputs are mapped to those copies instead of being copied again.
+        # pypdf has no public API for it, without its mapping of copied objects inputs are appended as they are
+        id_translated = getattr(self.writer, "_id_translated", None)
+        if not isinstance(id_translated, dict):
+            self.writer.append(reader, pages=pages)
+            return
+        translated = id_translated.setdefault(id(reader), {"PreventGC": reader})
+        for idnum, digest in digests.items():
+            if digest is not None and idnum not in translated and digest in self.shared:
+                translated[idnum] = self.shared[digest]
+
+        self.writer.append(reader, pages=pages)
+
+        for idnum, digest in digests.items():
+            if digest is not None and digest not in self.shared and idnum in translated:
+                self.shared[digest] = translated[idnum]
+
+    def release(self, name):
+        # Objects are copied into the output on append, the reader is only needed to append it again
+        reader = self.readers.pop(name, None)
+        if reader is not None and isinstance(getattr(self.writer, "_id_translated", None), dict):
+            self.writer._id_translated.pop(id(reader), None)
+
+    def write(self, output, password=None):
+        if password is not None:
+            self.writer.encrypt(password, password + "owner")
+        self.writer.write(output)
+
+    def close(self):
+        self.writer.close()
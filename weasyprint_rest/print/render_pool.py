@@ -0,0 +1,311 @@
+import collections
+import copy
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import FileStorage
+
+from .reports import RenderedReport
+
+_global = {
+    "pool": None
+}
+
+
+def _read_storage(storage):
+    content = storage.stream.read()
+    if hasattr(storage.stream, "seek"):
+        storage.stream.seek(0)
+    return content
+
+
+def read_html(html):
+    # Rendered reports are passed on as text, so they are not encoded and decoded again
+    if isinstance(html, RenderedReport):
+        return html.content
+    return _read_storage(html)
+
+
+def _to_storage(filename, content_type, content):
+    return FileStorage(stream=io.BytesIO(content), filename=filename, content_type=content_type)
+
+
+def _to_html(content):
+    if isinstance(content, str):
+        return RenderedReport(content)
+    return _to_storage(None, "text/html", content)
+
+
+def _dump_content(content, files):
+    files.append(content.encode("utf-8") if isinstance(content, str) else content)
+    return {"file": len(files) - 1, "text": isinstance(content, str)}
+
+
+def _load_content(entry, files):
+    content = files[entry["file"]]
+    return content.decode("utf-8") if entry["text"] else content
+
+
+class RenderJob:
+    def __init__(self, html=None, url=None, styles=None, assets=None, template_name=None, optimize_images=False):
+        self.html = html
+        self.url = url
+        self.styles = styles if styles is not None else []
+        self.assets = assets if assets is not None else []
+        self.template_name = template_name
+        self.optimize_images = optimize_images
+
+    @classmethod
+    def create(cls, html, url, template, optimize_images):
+        return cls(
+            html=read_html(html) if html is not None else None,
+            url=url,
+            styles=[
+                (sheet.filename, sheet.content_type, _read_storage(sheet)) for sheet in template.style_files
+            ],
+            assets=[
+                (name, asset.content_type, _read_storage(asset)) for name, asset in template.assets.items()
+            ],
+            template_name=template.base_template.name if template.base_template is not None else None,
+            optimize_images=optimize_images
+        )
+
+    def with_html(self, html):
+        job = copy.copy(self)
+        job.html = html
+        return job
+
+    def dump(self, files):
+        # Contents are kept as raw files next to the JSON description of the job
+        if isinstance(self.html, list):
+            html = [_dump_content(h, files) for h in self.html]
+        else:
+            html = _dump_content(self.html, files) if self.html is not None else None
+        return {
+            "html": html,
+            "url": self.url,
+            "styles": [[name, content_type, _dump_content(c, files)] for name, content_type, c in self.styles],
+            "assets": [[name, content_type, _dump_content(c, files)] for name, content_type, c in self.assets],
+            "template_name": self.template_name,
+            "optimize_images": self.optimize_images
+        }
+
+    @classmethod
+    def load(cls, data, files):
+        if isinstance(data["html"], list):
+            html = [_load_content(h, files) for h in data["html"]]
+        else:
+            html = _load_content(data["html"], files) if data["html"] is not None else None
+        return cls(
+            html=html,
+            url=data["url"],
+            styles=[(name, content_type, _load_content(c, files)) for name, content_type, c in data["styles"]],
+            assets=[(name, content_type, _load_content(c, files)) for name, content_type, c in data["assets"]],
+            template_name=data["template_name"],
+            optimize_images=data["optimize_images"]
+        )
+
+    def build_template(self):
+        from .template import Template
+        from .template_loader import TemplateLoader
+
+        return Template(
+            styles=[_to_storage(*style) for style in self.styles],
+            assets=[_to_storage(*asset) for asset in self.assets],
+            base_template=TemplateLoader().get(self.template_name)
+        )
+
+    def build_html(self):
+        if isinstance(self.html, list):
+            return [_to_html(html) for html in self.html]
+        return _to_html(self.html) if self.html is not None else None
+
+    def render(self):
+        from .weasyprinter import WeasyPrinter
+
+        template = self.build_template()
+        html = self.build_html()
+        if isinstance(html, list):
+            return WeasyPrinter(template=template).write_combined(html, self.optimize_images)
+        return WeasyPrinter(html=html, url=self.url, template=template).write(self.optimize_images)
+
+
+def _worker_main(connection, template_directory):
+    from .font_registry import install_subset_cache
+    from .template_loader import TemplateLoader
+    from ..env import get_template_reload_interval, is_template_prewarm_enabled, is_template_prewarm_render_enabled
+
+    install_subset_cache()
+    loader = TemplateLoader()
+    loader.load(template_directory)
+    # Workers render in this thread, their styles are parsed before the first job arrives
+    loader.prewarm(is_template_prewarm_enabled() and is_template_prewarm_render_enabled())
+    connection.send((True, None))
+    if get_template_reload_interval() > 0:
+        loader.watch(template_directory, get_template_reload_interval())
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        try:
+            connection.send((True, job.render()))
+        except Exception as e:
+            logging.exception("Render worker failed to print document")
+            connection.send((False, RuntimeError(str(e))))
+
+    connection.close()
+
+
+class _Worker:
+    def __init__(self, context, template_directory):
+        self.context = context
+        self.template_directory = template_directory
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.renders = 0
+        self.process = None
+        self.connection = None
+        self.warming = False
+        self.start()
+
+    def start(self):
+        parent_connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_connection, self.template_directory),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.connection = parent_connection
+        self.renders = 0
+        self.warming = True
+
+    def wait_ready(self):
+        with self.lock:
+            self._receive_ready()
+
+    def _receive_ready(self):
+        # The worker reports once its templates are prewarmed, before it takes the first job
+        if not self.warming:
+            return
+        try:
+            self.connection.recv()
+        except (EOFError, OSError):  # pragma: no cover
+            pass
+        self.warming = False
+
+    def stop(self, timeout=5):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():  # pragma: no cover
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+    def render(self, job, max_renders):
+        with self.lock:
+            if not self.process.is_alive():  # pragma: no cover
+                logging.warning("Render worker %r died, starting a new one" % self.process.pid)
+                self.connection.close()
+                self.start()
+
+            try:
+                self._receive_ready()
+                self.connection.send(job)
+                success, result = self.connection.recv()
+            except (EOFError, OSError) as e:  # pragma: no cover
+                self.stop(timeout=0)
+                self.start()
+                raise RuntimeError("Render worker stopped while printing document") from e
+
+            self.renders += 1
+            if 0 < max_renders <= self.renders:
+                self.stop()
+                self.start()
+
+        if not success:
+            raise result
+        return result
+
+
+class RenderPool:
+    def __init__(self, size, queue_depth, max_renders, template_directory):
+        self.queue_depth = max(queue_depth, 1)
+        self.max_renders = max_renders
+        self.condition = threading.Condition()
+        context = multiprocessing.get_context("spawn")
+        self.workers = [_Worker(context, template_directory) for _ in range(size)]
+        self.ready = threading.Event()
+        threading.Thread(target=self._wait_ready, name="render-pool-prewarm", daemon=True).start()
+
+    def render(self, job):
+        worker = self._acquire()
+        try:
+            return worker.render(job, self.max_renders)
+        finally:
+            self._release(worker)
+
+    def size(self):
+        return len(self.workers)
+
+    def close(self):
+        for worker in self.workers:
+            with worker.lock:
+                worker.stop()
+
+    def _wait_ready(self):
+        for worker in self.workers:
+            worker.wait_ready()
+        self.ready.set()
+
+    def _acquire(self):
+        with self.condition:
+            while True:
+                worker = min(self.workers, key=lambda w: w.pending)
+                if worker.pending < self.queue_depth:
+                    worker.pending += 1
+                    return worker
+                self.condition.wait()
+
+    def _release(self, worker):
+        with self.condition:
+            worker.pending -= 1
+            self.condition.notify()
+
+
+def map_ordered(func, items, parallelism):
+    if parallelism <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = collections.deque()
+        for item in items:
+            futures.append(executor.submit(func, item))
+            if len(futures) >= parallelism:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def start_render_pool(size, queue_depth, max_renders, template_directory):
+    if _global["pool"] is None:
+        _global["pool"] = RenderPool(size, queue_depth, max_renders, template_directory)
+    return _global["pool"]
+
+
+def render_pool():
+    return _global["pool"]
@@ -0,0 +1,65 @@
+import io
+import logging
+import os
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+from ..env import (
+    get_report_cache_size, get_report_bytecode_cache_directory, is_report_auto_reload_enabled
+)
+
+
+class RenderedReport:
+    # Report output is handed to WeasyPrint as the rendered text, it is only encoded where bytes are needed
+    filename = None
+    content_type = "text/html"
+    mimetype = "text/html"
+
+    def __init__(self, content):
+        self.content = content
+        self.encoded = None
+
+    @property
+    def stream(self):
+        return io.BytesIO(self.read())
+
+    def read(self):
+        if self.encoded is None:
+            self.encoded = self.content.encode("utf-8")
+        return self.encoded
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return 0
+
+    def save(self, destination):
+        with open(destination, "wb") as file:
+            file.write(self.read())
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "<RenderedReport: %d characters>" % len(self.content)
+
+
+def configure_reports(app):
+    # Compiled reports are kept in a sized cache, checked for changes on use and their bytecode kept on disk
+    options = dict(app.jinja_options, cache_size=get_report_cache_size(), auto_reload=is_report_auto_reload_enabled())
+    directory = get_report_bytecode_cache_directory()
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        options["bytecode_cache"] = FileSystemBytecodeCache(directory)
+    app.jinja_options = options
+
+
+def precompile_reports(app):
+    environment = app.jinja_env
+    compiled = 0
+    for name in environment.list_templates():
+        try:
+            environment.get_template(name)
+            compiled += 1
+        except (TemplateError, UnicodeDecodeError) as e:
+            logging.debug("Report %r could not be compiled: %s" % (name, e))
+    logging.info("Compiled %d reports" % compiled)
+    return compiled
@@ -0,0 +1,152 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from ..env import (
+    is_result_cache_enabled, get_result_cache_memory_size, get_result_cache_directory,
+    get_result_cache_disk_size, get_result_cache_ttl
+)
+
+_global = {
+    "cache": None
+}
+
+
+class ResultCache:
+    def __init__(self, memory_size, directory, disk_size, ttl):
+        self.memory_size = memory_size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self.entries = OrderedDict()
+        self.disk_entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index_directory()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove_memory_entry(key)
+
+        content = self._read_disk_entry(key, now)
+        with self.lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        self._store_memory_entry(key, content, now + self.ttl)
+        return content
+
+    def put(self, key, content):
+        expires = time.time() + self.ttl
+        self._store_memory_entry(key, content, expires)
+        if self.directory and len(content) <= self.disk_size:
+            self._write_disk_entry(key, content)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size": self.size,
+                "disk_entries": len(self.disk_entries),
+                "disk_size": sum(self.disk_entries.values())
+            }
+
+    def _store_memory_entry(self, key, content, expires):
+        if len(content) > self.memory_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove_memory_entry(key)
+            self.entries[key] = (content, expires)
+            self.size += len(content)
+            while self.size > self.memory_size:
+                self._remove_memory_entry(next(iter(self.entries)))
+
+    def _remove_memory_entry(self, key):
+        content, _ = self.entries.pop(key)
+        self.size -= len(content)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pdf")
+
+    def _index_directory(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pdf"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk_entries[key] = size
+
+    def _read_disk_entry(self, key, now):
+        if not self.directory:
+            return None
+
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                self._remove_disk_entry(key)
+                return None
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk_entry(self, key, content):
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+                file.write(content)
+            os.replace(file.name, self._path(key))
+        except OSError as e:  # pragma: no cover
+            logging.warning("Could not write result cache entry %r: %s" % (key, e))
+            return
+
+        with self.lock:
+            self.disk_entries.pop(key, None)
+            self.disk_entries[key] = len(content)
+            evicted = []
+            while sum(self.disk_entries.values()) > self.disk_size:
+                evicted.append(self.disk_entries.popitem(last=False)[0])
+
+        for evicted_key in evicted:
+            self._remove_disk_entry(evicted_key)
+
+    def _remove_disk_entry(self, key):
+        with self.lock:
+            self.disk_entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def result_cache():
+    if _global["cache"] is None and is_result_cache_enabled():
+        _global["cache"] = ResultCache(
+            get_result_cache_memory_size(),
+            get_result_cache_directory(),
+            get_result_cache_disk_size(),
+            get_result_cache_ttl()
+        )
+    return _global["cache"]
@@ -0,0 +1,61 @@
+import threading
+
+_global = {
+    "single_flight": None
+}
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.calls)
+            }
+
+
+def single_flight():
+    if _global["single_flight"] is None:
+        _global["single_flight"] = SingleFlight()
+    return _global["single_flight"]
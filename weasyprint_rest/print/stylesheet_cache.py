@@ -0,0 +1,82 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from ..env import get_stylesheet_cache_size
+
+# Rules fetching resources while the sheet is parsed depend on the assets and fonts of the request
+PARSE_TIME_FETCH_RE = re.compile(rb'@(import|font-face)', re.IGNORECASE)
+
+_global = {
+    "cache": None
+}
+
+
+class StylesheetCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, content, base_url, font_config, parse):
+        key = (hashlib.sha256(content).hexdigest(), base_url, None)
+        if PARSE_TIME_FETCH_RE.search(content):
+            # Parsing registers fonts, so the sheet is only valid for the font configuration it was parsed with
+            font_key = getattr(font_config, "registry_key", None)
+            if font_key is None:
+                return parse()
+            key = key[:2] + (font_key,)
+            parse = _locked(font_config.lock, parse)
+
+        if self.max_size <= 0:
+            return parse()
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        stylesheet = parse()
+        self._store(key, stylesheet, len(content))
+        return stylesheet
+
+    def _store(self, key, stylesheet, size):
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (stylesheet, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size": self.size
+            }
+
+
+def _locked(lock, func):
+    def call():
+        with lock:
+            return func()
+    return call
+
+
+def stylesheet_cache():
+    if _global["cache"] is None:
+        _global["cache"] = StylesheetCache(get_stylesheet_cache_size())
+    return _global["cache"]
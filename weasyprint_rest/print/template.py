@@ -1,21 +1,36 @@
+import hashlib
+import io
 import mimetypes
 import os
 import re
+import threading
 
 from weasyprint import CSS, default_url_fetcher
-from weasyprint.text.fonts import FontConfiguration
 
+from .asset_store import StoredAsset
+from .font_registry import font_registry, is_font_file
 from .non_closable import NonClosable
+from .stylesheet_cache import stylesheet_cache
+from .url_fetcher import url_fetcher
 from ..web.util import check_url_access
 
 UNICODE_SCHEME_RE = re.compile('^([a-zA-Z][a-zA-Z0-9.+-]+):')
 BASE64_DATA_RE = re.compile('^data:[^;]+;base64,')
+HTTP_URL_RE = re.compile('^https?://', re.IGNORECASE)
+
+
+def _read(storage):
+    content = storage.read()
+    if hasattr(storage, "seek"):
+        storage.seek(0)
+    return content
 
 
 class Template:
     def __init__(self, styles=None, assets=None, base_template=None, name=None):
         self.base_template = base_template
-        self.font_config = FontConfiguration()
+        # Font maps are not thread safe, the configuration and the styles using it are kept per thread
+        self.local = threading.local()
         self.name = name
 
         if assets is not None:
@@ -23,17 +38,11 @@ class Template:
         else:
             self.assets = {}
 
-        if styles is not None:
-            self.styles = ([
-                CSS(
-                    file_obj=sheet,
-                    url_fetcher=self.url_fetcher,
-                    font_config=self.font_config,
-                    base_url=os.path.join(os.getcwd(), os.path.basename(sheet.filename))
-                ) for sheet in styles
-            ])
-        else:
-            self.styles = []
+        self.style_files = styles if styles is not None else []
+        self.style_sources = None
+        self.signature = None
+        self.asset_signature = None
+        self._lock = threading.RLock()
 
     def has_asset(self, name):
         if name in self.assets:
@@ -45,13 +54,99 @@ class Template:
             return self.assets[name]
         return self.base_template.get_asset(name) if self.base_template is not None else None
 
-    def get_styles(self):
-        return self.styles + (self.base_template.get_styles() if self.base_template is not None else [])
+    def save_asset(self, name, path):
+        asset = self.assets[name]
+        if isinstance(asset, StoredAsset):
+            asset.save(path)
+            return
+
+        # Streams of uploaded assets are shared between renders of the request
+        with self._lock:
+            asset.stream.seek(0)
+            asset.save(path)
+            asset.stream.seek(0)
+
+    def get_styles(self, font_config=None):
+        if font_config is None or font_config is self.get_font_config():
+            font_config = self.get_font_config()
+            if getattr(self.local, "styles", None) is None:
+                self.local.styles = self._parse_styles(font_config)
+            styles = self.local.styles
+        else:
+            styles = self._parse_styles(font_config)
+
+        return styles + (self.base_template.get_styles(font_config) if self.base_template is not None else [])
+
+    def get_style_sources(self):
+        with self._lock:
+            if self.style_sources is None:
+                self.style_sources = [
+                    (_read(sheet), os.path.join(os.getcwd(), os.path.basename(sheet.filename)))
+                    for sheet in self.style_files
+                ]
+        return self.style_sources
+
+    def _parse_styles(self, font_config):
+        return [
+            stylesheet_cache().get(content, base_url, font_config, lambda c=content, b=base_url: CSS(
+                file_obj=io.BytesIO(c),
+                url_fetcher=self.url_fetcher,
+                font_config=font_config,
+                base_url=b
+            )) for content, base_url in self.get_style_sources()
+        ]
 
     def get_font_config(self):
-        return self.font_config
-
-    def url_fetcher(self, url):
+        # A configuration is only shared by renders of the same thread, it is dropped with the thread
+        if getattr(self.local, "font_config", None) is None:
+            self.local.font_config = font_registry().get((self.get_font_signature(), threading.get_ident()))
+        return self.local.font_config
+
+    def get_font_signature(self):
+        # Fonts are registered by @font-face rules, so everything that can contain or resolve them is part of it
+        with self._lock:
+            if self.signature is None:
+                parts = [base_url.encode() + hashlib.sha256(content).digest()
+                         for content, base_url in self.get_style_sources()]
+                parts += [name.encode() + hashlib.sha256(_read(self.assets[name])).digest()
+                          for name in sorted(self.assets) if name.lower().endswith(".css") or is_font_file(name)]
+
+                if not parts and self.base_template is not None:
+                    self.signature = self.base_template.get_font_signature()
+                else:
+                    digest = hashlib.sha256()
+                    if self.base_template is not None:
+                        digest.update(self.base_template.get_font_signature().encode())
+                    for part in parts:
+                        digest.update(part)
+                    self.signature = digest.hexdigest()
+        return self.signature
+
+    def get_asset_signature(self):
+        with self._lock:
+            if self.asset_signature is None:
+                if not self.assets and self.base_template is not None:
+                    self.asset_signature = self.base_template.get_asset_signature()
+                else:
+                    digest = hashlib.sha256()
+                    if self.base_template is not None:
+                        digest.update(self.base_template.get_asset_signature().encode())
+                    for name in sorted(self.assets):
+                        digest.update(name.encode() + hashlib.sha256(_read(self.assets[name])).digest())
+                    self.asset_signature = digest.hexdigest()
+        return self.asset_signature
+
+    def get_content_signature(self):
+        # Styles of a template definition are not necessarily part of its assets
+        digest = hashlib.sha256(self.get_asset_signature().encode())
+        template = self
+        while template is not None:
+            for content, base_url in template.get_style_sources():
+                digest.update(base_url.encode() + hashlib.sha256(content).digest())
+            template = template.base_template
+        return digest.hexdigest()
+
+    def url_fetcher(self, url, budget=None):
         if not UNICODE_SCHEME_RE.match(url):  # pragma: no cover
             raise ValueError('Not an absolute URI: %r' % url)
 
@@ -61,7 +156,10 @@ class Template:
         if not check_url_access(url) and not BASE64_DATA_RE.match(url):
             raise PermissionError('Requested URL %r was blocked because of restriction definitions.' % url)
 
-        fetch_result = default_url_fetcher(url)
+        if HTTP_URL_RE.match(url):
+            fetch_result = url_fetcher().fetch(url, budget, check_url_access)
+        else:
+            fetch_result = default_url_fetcher(url)
         if fetch_result["mime_type"] == "text/plain":
             fetch_result["mime_type"] = mimetypes.guess_type(url)[0]
 
@@ -84,10 +182,10 @@ class Template:
 
         return {
             'mime_type': mimetype,
-            'file_obj': NonClosable(file),
+            'file_obj': file.open() if isinstance(file, StoredAsset) else NonClosable(file),
             'filename': file_path,
             'redirected_url': file.name
         }
 
     def __str__(self):
-        return "Template {styles=" + str(self.styles) + ", assets=" + str(self.assets) + "}"
+        return "Template {styles=" + str(self.style_files) + ", assets=" + str(self.assets) + "}"
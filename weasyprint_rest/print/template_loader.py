@@ -1,14 +1,33 @@
+import io
 import json
 import glob
 import os
 import logging
 import mimetypes
+import tempfile
+import threading
+import time
 
 from werkzeug.datastructures import FileStorage
 
+from .asset_store import StoredAsset, asset_store
 from .template import Template
+from .weasyprinter import WeasyPrinter
 from ..env import is_debug_mode
 
+INDEX_VERSION = 1
+PREWARM_HTML = b"<html><body><p>Prewarm</p></body></html>"
+
+
+def _snapshot(base_dir):
+    snapshot = {}
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
 
 class TemplateLoader:
     instance = None
@@ -23,20 +42,125 @@ class TemplateLoader:
     class __TemplateLoader:
         def __init__(self):
             self.template_definitions = {}
+            self.directories = set()
+            self.ready = threading.Event()
+            self.ready.set()
 
         def load(self, base_dir):
             for template_dir in os.listdir(base_dir):
                 abs_template_dir = os.path.join(base_dir, template_dir)
-                template_file = os.path.join(abs_template_dir, "template.json")
-                if not os.path.isfile(template_file):
-                    self.add_definition(abs_template_dir, {})
+                self.add_definition(abs_template_dir, self._read_definition(abs_template_dir))
+
+        def load_index(self, base_dir, index_file):
+            # The index is only used while no directory or file was changed since it was written
+            try:
+                with open(index_file) as json_file:
+                    index = json.load(json_file)
+                if index["version"] != INDEX_VERSION or index["base_dir"] != base_dir:
+                    return False
+                for directory, mtime in index["mtimes"].items():
+                    if os.stat(directory).st_mtime_ns != mtime:
+                        return False
+                for definition in index["definitions"]:
+                    definition["snapshot"] = {path: tuple(state) for path, state in definition["snapshot"].items()}
+                    if _snapshot(definition["base_dir"]) != definition["snapshot"]:
+                        return False
+            except (OSError, ValueError, KeyError):
+                return False
+
+            for definition in index["definitions"]:
+                definition["prepared"] = True
+                definition["template"] = None
+                self.template_definitions[definition["name"]] = definition
+            self.directories.update(index["directories"])
+            return True
+
+        def save_index(self, base_dir, index_file):
+            definitions = []
+            for definition in list(self.template_definitions.values()):
+                if not definition["prepared"]:
+                    self._prepare_definition(definition)
+                definitions.append({key: value for key, value in definition.items() if key != "template"})
+
+            mtimes = {base_dir: os.stat(base_dir).st_mtime_ns}
+            for directory in self.directories:
+                for root, _, _ in os.walk(directory):
+                    mtimes[root] = os.stat(root).st_mtime_ns
+
+            index = {
+                "version": INDEX_VERSION,
+                "base_dir": base_dir,
+                "directories": sorted(self.directories),
+                "mtimes": mtimes,
+                "definitions": definitions
+            }
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(index_file)), suffix=".tmp",
+                                             delete=False) as file:
+                json.dump(index, file)
+            os.replace(file.name, index_file)
+
+        def prewarm(self, render=False):
+            for name in list(self.template_definitions):
+                try:
+                    template = self.get(name)
+                    template.get_styles()
+                    if render:
+                        html = FileStorage(stream=io.BytesIO(PREWARM_HTML), content_type="text/html")
+                        WeasyPrinter(html=html, template=Template(base_template=template)).write()
+                except Exception:
+                    logging.exception("Template %r could not be prewarmed" % name)
+            self.ready.set()
+
+        def watch(self, base_dir, interval):
+            thread = threading.Thread(target=self._watch, args=(base_dir, interval), name="template-watcher",
+                                      daemon=True)
+            thread.start()
+
+        def reload(self, base_dir):
+            # Only templates with changed files are rebuilt, requests keep using the previous one until it is ready
+            directories = {os.path.join(base_dir, template_dir) for template_dir in os.listdir(base_dir)}
+            for name, definition in list(self.template_definitions.items()):
+                if os.path.normpath(os.path.dirname(definition["base_dir"])) != os.path.normpath(base_dir):
                     continue
-                with open(template_file) as json_file:
-                    self.add_definition(abs_template_dir, json.load(json_file))
-
-        def add_definition(self, base_dir, definition):
+                if definition["base_dir"] not in directories:
+                    logging.info("Template %r was removed" % name)
+                    del self.template_definitions[name]
+                    self.directories.discard(definition["base_dir"])
+                elif _snapshot(definition["base_dir"]) != definition["snapshot"]:
+                    self._reload_definition(definition["base_dir"], name)
+
+            for template_dir in sorted(directories - self.directories):
+                self._reload_definition(template_dir)
+
+        def _watch(self, base_dir, interval):
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload(base_dir)
+                except OSError:
+                    logging.exception("Reloading templates from %r failed" % base_dir)
+
+        def _reload_definition(self, base_dir, previous_name=None):
+            try:
+                definition = self._read_definition(base_dir)
+                if previous_name is not None and definition.get("name", os.path.basename(base_dir)) != previous_name:
+                    del self.template_definitions[previous_name]
+                self.add_definition(base_dir, definition, replace=previous_name is not None)
+            except (OSError, ValueError):
+                logging.exception("Template in %r could not be reloaded" % base_dir)
+
+        def _read_definition(self, base_dir):
+            template_file = os.path.join(base_dir, "template.json")
+            if not os.path.isfile(template_file):
+                return {}
+            with open(template_file) as json_file:
+                return json.load(json_file)
+
+        def add_definition(self, base_dir, definition, replace=False):
             name = definition["name"] if "name" in definition else os.path.basename(base_dir)
-            if name in self.template_definitions:
+            self.directories.add(base_dir)
+            existing = self.template_definitions.get(name)
+            if existing is not None and not (replace and existing["base_dir"] == base_dir):
                 logging.warn(
                     "Template %r found in %r was already defined. This template will be ignored" % (name, base_dir))
                 return
@@ -45,14 +169,19 @@ class TemplateLoader:
             definition["base_dir"] = base_dir
             definition["prepared"] = False
             definition["template"] = None
+            definition["snapshot"] = _snapshot(base_dir)
+            if replace:
+                self._prepare_definition(definition)
+                self._build_template(definition)
+                logging.info("Template %r was reloaded from %r" % (name, base_dir))
             self.template_definitions[name] = definition
 
         def get(self, name):
-            if name not in self.template_definitions:
+            # Looked up once, the watcher may remove the definition at any time
+            definition = self.template_definitions.get(name)
+            if definition is None:
                 return None
 
-            definition = self.template_definitions[name]
-
             if not definition["prepared"] or is_debug_mode():
                 self._prepare_definition(definition)
 
@@ -83,8 +212,7 @@ class TemplateLoader:
             styles = self._read_files(base_dir, definition["styles"])
             assets = self._read_files(base_dir, definition["assets"])
 
-            template = Template(styles=styles, assets=assets, name=definition['name'])
-            definition["template"] = template
+            definition["template"] = Template(styles=styles, assets=assets, name=definition['name'])
 
         def _read_files(self, base_dir, file_locations):
             files = []
@@ -92,9 +220,10 @@ class TemplateLoader:
                 if not os.path.isfile(file):
                     continue
 
-                files.append(FileStorage(
-                    stream=open(file, "rb"),
-                    filename=os.path.relpath(file, base_dir),
-                    content_type=mimetypes.guess_type(file)[0]
+                files.append(StoredAsset(
+                    asset_store(),
+                    file,
+                    os.path.relpath(file, base_dir),
+                    mimetypes.guess_type(file)[0]
                 ))
             return files
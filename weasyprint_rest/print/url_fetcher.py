@@ -0,0 +1,541 @@
+import email.utils
+import hashlib
+import http.client
+import json
+import logging
+import os
+import re
+import ssl
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urljoin, urlsplit
+
+from ..env import (
+    get_url_fetch_timeout, get_url_fetch_render_timeout, get_url_fetch_max_bytes, get_url_fetch_pool_size,
+    get_url_prefetch_workers, get_url_prefetch_slots, get_url_cache_memory_size, get_url_cache_directory, get_url_cache_disk_size
+)
+
+MAX_REDIRECTS = 5
+READ_SIZE = 64 * 1024
+HTTP_HEADERS = {
+    "User-Agent": "easy-pdf-rest",
+    "Accept": "*/*",
+    "Accept-Encoding": "gzip, deflate"
+}
+RETRY_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+# Only references WeasyPrint loads while rendering, links of anchors are never requested
+EMBEDDED_URL_RE = re.compile(
+    rb'''<(?:img\b[^>]*?\bsrc|embed\b[^>]*?\bsrc|object\b[^>]*?\bdata)\s*=\s*["']?(https?://[^"'\s>]+)''', re.IGNORECASE
+)
+CSS_URL_RE = re.compile(rb'''url\(\s*["']?(https?://[^"')\s>]+)''', re.IGNORECASE)
+LINK_TAG_RE = re.compile(rb'<link\b[^>]*>', re.IGNORECASE)
+LINK_REL_RE = re.compile(rb'''\brel\s*=\s*["']?([^"'>]*)''', re.IGNORECASE)
+LINK_HREF_RE = re.compile(rb'''\bhref\s*=\s*["']?(https?://[^"'\s>]+)''', re.IGNORECASE)
+
+_global = {
+    "fetcher": None
+}
+
+
+class FetchBudget:
+    # Time and bytes all remote resources of one render may take together
+    def __init__(self, timeout, max_bytes):
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.prefetched = {}
+        self.pending = {}
+        self.running = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        if self.closed:
+            raise TimeoutError("The document was already rendered")
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Time for fetching remote resources of the document is exhausted")
+        return remaining
+
+    def consume(self, size):
+        with self.lock:
+            self.bytes += size
+            if 0 < self.max_bytes < self.bytes:
+                raise ValueError("Remote resources of the document exceed %d bytes" % self.max_bytes)
+
+    def close(self):
+        # Prefetches the render did not use are cancelled, running ones stop at their next read
+        with self.lock:
+            self.closed = True
+            futures = list(self.prefetched.values())
+        for future in futures:
+            future.cancel()
+
+
+class ConnectionPool:
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+        self.ssl_context = ssl.create_default_context()
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme, host, port, timeout):
+        key = (scheme, host, port)
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                self.reused += 1
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+            self.opened += 1
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def release(self, scheme, host, port, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, host, port), [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "idle": sum(len(connections) for connections in self.idle.values())
+            }
+
+
+def _freshness(headers, now):
+    # Seconds a response may be used without asking the server again, None if it must not be stored
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+
+    age = int(headers.get("Age", 0)) if headers.get("Age", "").isdigit() else 0
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name, "").isdigit():
+            return max(0, int(directives[name]) - age)
+
+    if headers.get("Expires"):
+        try:
+            return max(0, email.utils.parsedate_to_datetime(headers["Expires"]).timestamp() - now)
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+
+class _Decoder:
+    # Compressed bodies are inflated a piece at a time, so the budget is charged with the size they expand to
+    def __init__(self, content_encoding):
+        self.content_encoding = content_encoding
+        self.inflater = None
+
+    def finished(self):
+        return self.inflater is not None and self.inflater.eof
+
+    def decode(self, chunk):
+        if self.content_encoding not in ("gzip", "deflate"):
+            yield chunk
+            return
+        if self.inflater is None:
+            self.inflater = zlib.decompressobj(_wbits(self.content_encoding, chunk))
+
+        data = self.inflater.decompress(chunk, READ_SIZE)
+        while data:
+            yield data
+            if self.inflater.eof or (not self.inflater.unconsumed_tail and len(data) < READ_SIZE):
+                return
+            data = self.inflater.decompress(self.inflater.unconsumed_tail, READ_SIZE)
+
+
+def _wbits(content_encoding, chunk):
+    if content_encoding == "gzip":
+        return 16 + zlib.MAX_WBITS
+    # Some servers send deflate without the zlib header
+    if len(chunk) >= 2 and chunk[0] & 0x0f == 8 and (chunk[0] << 8 | chunk[1]) % 31 == 0:
+        return zlib.MAX_WBITS
+    return -zlib.MAX_WBITS
+
+
+class HttpCache:
+    def __init__(self, memory_size, directory, disk_size):
+        self.memory_size = memory_size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.size = 0
+        self.entries = OrderedDict()
+        self.disk_entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index_directory()
+
+    def get(self, url):
+        key = _key(url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = self._read_disk_entry(key)
+        if entry is not None:
+            self._store_memory_entry(key, entry)
+        return entry
+
+    def put(self, url, entry):
+        key = _key(url)
+        self._store_memory_entry(key, entry)
+        if self.directory and len(entry["body"]) <= self.disk_size:
+            self._write_disk_entry(key, entry)
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "entries": len(self.entries),
+                "size": self.size,
+                "disk_entries": len(self.disk_entries),
+                "disk_size": sum(self.disk_entries.values())
+            }
+
+    def _store_memory_entry(self, key, entry):
+        if len(entry["body"]) > self.memory_size:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous["body"])
+            self.entries[key] = entry
+            self.size += len(entry["body"])
+            while self.size > self.memory_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted["body"])
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".http")
+
+    def _index_directory(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".http"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk_entries[key] = size
+
+    def _read_disk_entry(self, key):
+        if not self.directory:
+            return None
+
+        try:
+            with open(self._path(key), "rb") as file:
+                entry = json.loads(file.readline())
+                entry["body"] = file.read()
+                return entry
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self._remove_disk_entry(key)
+            return None
+
+    def _write_disk_entry(self, key, entry):
+        meta = json.dumps({name: value for name, value in entry.items() if name != "body"}).encode()
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+                file.write(meta + b"\n")
+                file.write(entry["body"])
+            os.replace(file.name, self._path(key))
+        except OSError as e:  # pragma: no cover
+            logging.warning("Could not write url cache entry %r: %s" % (key, e))
+            return
+
+        with self.lock:
+            self.disk_entries.pop(key, None)
+            self.disk_entries[key] = len(meta) + 1 + len(entry["body"])
+            evicted = []
+            while sum(self.disk_entries.values()) > self.disk_size:
+                evicted.append(self.disk_entries.popitem(last=False)[0])
+
+        for evicted_key in evicted:
+            self._remove_disk_entry(evicted_key)
+
+    def _remove_disk_entry(self, key):
+        with self.lock:
+            self.disk_entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _resource_urls(html):
+    for url in EMBEDDED_URL_RE.findall(html):
+        yield url
+    for tag in LINK_TAG_RE.findall(html):
+        rel = LINK_REL_RE.search(tag)
+        href = LINK_HREF_RE.search(tag)
+        if rel is not None and href is not None and b"stylesheet" in rel.group(1).lower().split():
+            yield href.group(1)
+    for url in CSS_URL_RE.findall(html):
+        yield url
+
+
+def _key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _to_uri(url):
+    return quote(url, safe="/:?#[]@!$&'()*+,;=%~")
+
+
+def _result(entry):
+    return {
+        "string": entry["body"],
+        "mime_type": entry["mime_type"],
+        "encoding": entry["encoding"],
+        "redirected_url": entry["redirected_url"]
+    }
+
+
+class UrlFetcher:
+    def __init__(self, pool, cache, timeout, prefetch_workers, prefetch_slots=2):
+        self.pool = pool
+        self.cache = cache
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=prefetch_workers) if prefetch_workers > 0 else None
+        self.prefetch_slots = max(1, prefetch_slots)
+        self.fetches = 0
+        self.prefetches = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, url, budget=None, check_access=None):
+        future = None
+        if budget is not None:
+            with budget.lock:
+                future = budget.prefetched.pop(url, None)
+                budget.pending.pop(url, None)
+        # A prefetch that did not start yet is not waited for, the render fetches it itself
+        if future is not None and not future.cancel():
+            return future.result(budget.remaining())
+        return self._fetch(url, budget, check_access)
+
+    def prefetch(self, html, budget, check_access=None):
+        # Remote resources named in the document are requested while the document is still being parsed
+        if self.executor is None:
+            return
+        for url in dict.fromkeys(match.decode("ascii", "replace") for match in _resource_urls(html)):
+            if url in budget.prefetched or url in budget.pending:
+                continue
+            if check_access is None or check_access(url):
+                budget.pending[url] = check_access
+        self._start_prefetches(budget)
+
+    def _start_prefetches(self, budget):
+        # Every render only keeps a few prefetches queued, so it never waits behind all downloads of another one
+        futures = []
+        with budget.lock:
+            while budget.pending and budget.running < self.prefetch_slots and not budget.closed:
+                url = next(iter(budget.pending))
+                check_access = budget.pending.pop(url)
+                budget.running += 1
+                budget.prefetched[url] = self.executor.submit(self._fetch, url, budget, check_access)
+                futures.append(budget.prefetched[url])
+        with self.lock:
+            self.prefetches += len(futures)
+        for future in futures:
+            future.add_done_callback(lambda _: self._prefetch_done(budget))
+
+    def _prefetch_done(self, budget):
+        with budget.lock:
+            budget.running -= 1
+        self._start_prefetches(budget)
+
+    def stats(self):
+        with self.lock:
+            fetches = self.fetches
+            prefetches = self.prefetches
+        return {
+            "fetches": fetches,
+            "prefetches": prefetches,
+            "connections": self.pool.stats(),
+            "cache": self.cache.stats()
+        }
+
+    def _fetch(self, url, budget, check_access):
+        with self.lock:
+            self.fetches += 1
+
+        now = time.time()
+        cached = self.cache.get(url)
+        if cached is not None and cached["expires"] > now:
+            self.cache.count("hits")
+            return _result(cached)
+        self.cache.count("misses")
+
+        headers = dict(HTTP_HEADERS)
+        if cached is not None and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached is not None and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        location = url
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(location, headers, budget, check_access)
+            if status in (301, 302, 303, 307, 308) and response_headers.get("Location"):
+                location = urljoin(location, response_headers["Location"])
+                if check_access is not None and not check_access(location):
+                    raise PermissionError("Redirect to URL %r was blocked because of restriction definitions." %
+                                          location)
+                continue
+            break
+        else:
+            raise ValueError("Too many redirects for URL %r" % url)
+
+        freshness = _freshness(response_headers, now)
+        if status == 304 and cached is not None:
+            self.cache.count("revalidated")
+            if freshness is not None:
+                cached = dict(cached, expires=now + freshness)
+                self.cache.put(url, cached)
+            return _result(cached)
+        if status != 200:
+            raise ValueError("URL %r returned HTTP status %d" % (url, status))
+
+        entry = {
+            "body": body,
+            "mime_type": response_headers.get_content_type(),
+            "encoding": response_headers.get_param("charset"),
+            "redirected_url": location,
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "expires": now + (freshness or 0)
+        }
+        # Responses without freshness are only kept when they can be revalidated
+        if freshness is not None and (freshness > 0 or entry["etag"] or entry["last_modified"]):
+            self.cache.put(url, entry)
+        return _result(entry)
+
+    def _request(self, url, headers, budget, check_access=None):
+        parts = urlsplit(_to_uri(url))
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Not an http URL: %r" % url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        host_header = parts.netloc.rpartition("@")[2]
+
+        while True:
+            timeout = self.timeout or None
+            remaining = budget.remaining() if budget is not None else None
+            if remaining is not None:
+                timeout = min(timeout, remaining) if timeout else remaining
+
+            connection, reused = self.pool.acquire(parts.scheme, parts.hostname, port, timeout)
+            try:
+                if check_access is not None:
+                    self._check_peer(connection, url, check_access)
+                connection.request("GET", target, headers=dict(headers, Host=host_header))
+                response = connection.getresponse()
+            except RETRY_ERRORS:
+                connection.close()
+                # An idle connection may have been closed by the server in the meantime
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            break
+
+        try:
+            body = self._read(response, budget)
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(parts.scheme, parts.hostname, port, connection)
+        return response.status, response.headers, body
+
+    @staticmethod
+    def _check_peer(connection, url, check_access):
+        # The host may resolve to another address than the one the URL was checked with
+        if connection.sock is None:
+            connection.connect()
+        address = connection.sock.getpeername()[0]
+        if not check_access(url, address):
+            raise PermissionError("URL %r connected to %s, which was blocked because of restriction definitions." %
+                                  (url, address))
+
+    @staticmethod
+    def _read(response, budget):
+        decoder = _Decoder(response.headers.get("Content-Encoding"))
+        chunks = []
+        while True:
+            if budget is not None:
+                budget.remaining()
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                return b"".join(chunks)
+            if decoder.finished():
+                # Data after the end of a compressed body is dropped, it still counts as read
+                if budget is not None:
+                    budget.consume(len(chunk))
+                continue
+            for data in decoder.decode(chunk):
+                if budget is not None:
+                    budget.consume(len(data))
+                chunks.append(data)
+
+
+def render_budget():
+    return FetchBudget(get_url_fetch_render_timeout(), get_url_fetch_max_bytes())
+
+
+def url_fetcher():
+    if _global["fetcher"] is None:
+        _global["fetcher"] = UrlFetcher(
+            ConnectionPool(get_url_fetch_pool_size()),
+            HttpCache(get_url_cache_memory_size(), get_url_cache_directory(), get_url_cache_disk_size()),
+            get_url_fetch_timeout(),
+            get_url_prefetch_workers(),
+            get_url_prefetch_slots()
+        )
+    return _global["fetcher"]
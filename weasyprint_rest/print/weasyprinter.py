@@ -1,25 +1,24 @@
-import io
+import functools
 import logging
 import os
+import re
 import shutil
+import tempfile
 import uuid
 
-import pdfkit
 from weasyprint import HTML
-from werkzeug.utils import secure_filename
+from weasyprint.text.fonts import FontConfiguration
 
 from weasyprint_rest.env import is_debug_mode
-from weasyprint_rest.web.util import encrypt
+from weasyprint_rest.web.util import check_url_access
+from .asset_directory import asset_directories
+from .image_cache import image_cache_view
+from .reports import RenderedReport
 from .template import Template
+from .url_fetcher import render_budget, url_fetcher
+from .wk_runner import wk_runner
 
-TMP_TEMPLATE_BASE = "/tmp/template_"
-
-
-def get_temp_dir(template, assets_count):
-    if template is None or assets_count > 0:
-        return "{0}{1}/".format(TMP_TEMPLATE_BASE, str(uuid.uuid1()))
-
-    return "{0}{1}/".format(TMP_TEMPLATE_BASE, secure_filename(template.name))
+FONT_FACE_RE = re.compile(rb'@font-face', re.IGNORECASE)
 
 
 def _fix_file_option(options, base_dir, option_name):
@@ -27,20 +26,10 @@ def _fix_file_option(options, base_dir, option_name):
         options[option_name] = base_dir + options[option_name]
 
 
-def create_directory_if_not_present(file_path):
-    directory = os.path.dirname(file_path)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-
-def encrypt_pdf(pdf_bytes, password=None):
-    if password is None:
-        return pdf_bytes
-
-    out_file = io.BytesIO()
-    encrypt(io.BytesIO(pdf_bytes), password, out_file)
-
-    return out_file.getvalue()
+def _declares_font_face(html):
+    content = html.read()
+    html.seek(0)
+    return FONT_FACE_RE.search(content) is not None
 
 
 class WeasyPrinter:
@@ -61,72 +50,115 @@ class WeasyPrinter:
         verbose = None
         if is_debug_mode():
             verbose = True
+        # Paths into the directory of this render must not leak into the options shared by other entries
+        options = dict(options or {})
 
         if self.url is not None:
-            return pdfkit.from_url(self.url, options=options, verbose=verbose)
+            return wk_runner().render(self.url, 'url', options=options, verbose=verbose)
 
         base_dir = self._prepare_base_dir()
         if base_dir is None:
-            pdf_bytes = pdfkit.from_string(self.html.read().decode(), options=options, verbose=verbose)
+            content = self.html.content if isinstance(self.html, RenderedReport) else self.html.read().decode()
+            pdf_bytes = wk_runner().render(content, 'string', options=options, verbose=verbose)
         else:
-            html_file = base_dir + str(uuid.uuid1()) + ".html"
-            self.html.save(html_file)
-            options['enable-local-file-access'] = None
-
-            _fix_file_option(options, base_dir, 'footer-html')
-            _fix_file_option(options, base_dir, 'header-html')
-
-            pdf_bytes = pdfkit.from_file(html_file, options=options, verbose=verbose)
-            self._cleanup_dir(base_dir, html_file)
+            try:
+                html_file = base_dir + str(uuid.uuid1()) + ".html"
+                self.html.save(html_file)
+                self._fix_local_options(options, base_dir)
+                pdf_bytes = wk_runner().render(html_file, 'file', options=options, verbose=verbose)
+            finally:
+                self._cleanup_dir(base_dir)
         return pdf_bytes
 
+    def write_batch_with_pdfkit(self, htmls, options):
+        # wkhtmltopdf lays out several input files in one run, so its startup is paid once per batch
+        verbose = True if is_debug_mode() else None
+        options = dict(options or {})
+        base_dir = self._prepare_base_dir()
+        work_dir = base_dir if base_dir is not None else tempfile.mkdtemp(prefix="wk_batch_") + "/"
+        html_files = []
+        try:
+            for html in htmls:
+                html_file = work_dir + str(uuid.uuid1()) + ".html"
+                html.save(html_file)
+                html_files.append(html_file)
+            if base_dir is not None:
+                self._fix_local_options(options, base_dir)
+
+            return wk_runner().render(html_files, 'file', options=options, verbose=verbose)
+        finally:
+            if base_dir is None:
+                shutil.rmtree(work_dir)
+            else:
+                self._cleanup_dir(base_dir)
+
+    @staticmethod
+    def _fix_local_options(options, base_dir):
+        options['enable-local-file-access'] = None
+        _fix_file_option(options, base_dir, 'footer-html')
+        _fix_file_option(options, base_dir, 'header-html')
+
     def _prepare_base_dir(self):
-        assets_count = len(self.template.assets)
-        if self.template.base_template is None and assets_count == 0:
+        if self.template.base_template is None and len(self.template.assets) == 0:
             logging.debug("No need to prepare dir")
             return None
 
-        base_dir = get_temp_dir(self.template.base_template, assets_count)
-
-        if os.path.exists(base_dir):
-            logging.warning("Directory already exists")
-            return base_dir
-        else:
-            os.makedirs(base_dir)
-
-        if self.template.base_template is not None:
-            for asset in self.template.base_template.assets:
-                create_directory_if_not_present(base_dir + asset)
-                self.template.get_asset(asset).save(base_dir + asset)
-
-        for asset in self.template.assets:
-            if not os.path.exists(base_dir + asset):
-                create_directory_if_not_present(base_dir + asset)
-                self.template.get_asset(asset).save(base_dir + asset)
-
-        return base_dir
+        return asset_directories().acquire(self.template)
 
     def _write_with_weasyprint(self, optimize_images):
-        if self.url is not None:
-            html = HTML(url=self.url, encoding="utf-8", url_fetcher=self.template.url_fetcher)
-        else:
-            html = HTML(file_obj=self.html, encoding="utf-8", url_fetcher=self.template.url_fetcher,
-                        base_url=os.getcwd())
-        font_config = self.template.get_font_config()
-        styles = self.template.get_styles() if self.template is not None else []
-        pdf_bytes = html.write_pdf(stylesheets=styles, image_cache=None, font_config=font_config,
-                                   optimize_images=optimize_images)
+        font_config = self._get_font_config([self.html])
+        budget = self._prefetch([self.html])
+        try:
+            html = self._build_html(self.html, budget)
+            styles = self.template.get_styles(font_config)
+            pdf_bytes = html.write_pdf(stylesheets=styles, cache=image_cache_view(self.template, optimize_images),
+                                       font_config=font_config, optimize_images=optimize_images)
+        finally:
+            budget.close()
         return pdf_bytes
 
-    def _cleanup_dir(self, base_dir, html_file):
-        if self.template.base_template is None:
-            shutil.rmtree(base_dir)
-            return
+    def write_combined(self, htmls, optimize_images=False):
+        # Streamed entries are read by every step below, they have to be taken from the stream once
+        htmls = list(htmls)
+        font_config = self._get_font_config(htmls)
+        styles = self.template.get_styles(font_config)
+        image_cache = image_cache_view(self.template, optimize_images)
+        budget = self._prefetch(htmls)
+        try:
+            documents = [
+                self._build_html(html, budget).render(stylesheets=styles, cache=image_cache, font_config=font_config,
+                                                      optimize_images=optimize_images)
+                for html in htmls
+            ]
+        finally:
+            budget.close()
+        pages = [page for document in documents for page in document.pages]
+        return documents[0].copy(pages).write_pdf(optimize_images=optimize_images)
+
+    def _get_font_config(self, htmls):
+        # Fonts declared by the document itself must not leak into the configuration shared with other requests
+        if self.url is not None or any(_declares_font_face(html) for html in htmls):
+            return FontConfiguration()
+        return self.template.get_font_config()
+
+    def _prefetch(self, htmls):
+        budget = render_budget()
+        if self.url is None:
+            for html in htmls:
+                url_fetcher().prefetch(html.read(), budget, check_url_access)
+                html.seek(0)
+        return budget
+
+    def _build_html(self, html, budget):
+        fetcher = functools.partial(self.template.url_fetcher, budget=budget)
+        if self.url is not None:
+            return HTML(url=self.url, encoding="utf-8", url_fetcher=fetcher)
+        if isinstance(html, RenderedReport):
+            return HTML(string=html.content, url_fetcher=fetcher, base_url=os.getcwd())
+        return HTML(file_obj=html, encoding="utf-8", url_fetcher=fetcher, base_url=os.getcwd())
 
-        if html_file.startswith(TMP_TEMPLATE_BASE + self.template.base_template.name + "/"):
-            os.remove(html_file)
-        else:
-            shutil.rmtree(base_dir)
+    def _cleanup_dir(self, base_dir):
+        asset_directories().release(base_dir)
 
     def close(self):
         pass
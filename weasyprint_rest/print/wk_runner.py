@@ -0,0 +1,122 @@
+import logging
+import subprocess
+import threading
+import time
+
+import pdfkit
+from pdfkit.pdfkit import PDFKit
+
+from ..env import get_wk_concurrency, get_wk_timeout
+
+# Seconds after which a failed version check of the binary is retried
+VERSION_CHECK_INTERVAL = 60
+
+_global = {
+    "runner": None
+}
+
+
+class WkRunner:
+    def __init__(self, concurrency, timeout):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.detected_version = None
+        self.version_checked = None
+        self.checking = False
+
+    def render(self, source, type_, options=None, verbose=False):
+        kit = PDFKit(source, type_, options=options, verbose=verbose)
+        args = kit.command()
+        if kit.source.isString():
+            stdin = kit.source.to_s().encode("utf-8")
+        else:
+            stdin = None
+
+        with self.lock:
+            self.waiting += 1
+        self.slots.acquire()
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            stdout, stderr, exit_code = self._run(args, stdin)
+        finally:
+            self.slots.release()
+            with self.lock:
+                self.running -= 1
+                self.runs += 1
+
+        stderr = (stderr or b"").decode("utf-8", errors="replace")
+        try:
+            PDFKit.handle_error(exit_code, stderr)
+        except IOError:
+            with self.lock:
+                self.failures += 1
+            raise
+        if verbose:
+            logging.debug(stderr)
+        return stdout
+
+    def _run(self, args, stdin):
+        process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            stdout, stderr = process.communicate(input=stdin, timeout=self.timeout or None)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            with self.lock:
+                self.timeouts += 1
+            raise TimeoutError("wkhtmltopdf did not finish within {0} seconds".format(self.timeout))
+        return stdout, stderr, process.returncode
+
+    def version(self):
+        # The binary is asked in the background, callers only get the version detected so far
+        with self.lock:
+            if self.detected_version is not None or self.checking or (
+                    self.version_checked is not None and
+                    time.monotonic() - self.version_checked < VERSION_CHECK_INTERVAL):
+                return self.detected_version
+            self.version_checked = time.monotonic()
+            self.checking = True
+
+        threading.Thread(target=self._detect_version, name="wk-version", daemon=True).start()
+        return None
+
+    def _detect_version(self):
+        detected_version = None
+        try:
+            binary = pdfkit.configuration().wkhtmltopdf
+            output = subprocess.run([binary, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=10, check=True).stdout
+            detected_version = output.decode("utf-8", errors="replace").strip().replace("wkhtmltopdf ", "", 1)
+        except (IOError, OSError, subprocess.SubprocessError) as error:
+            logging.warning("wkhtmltopdf is not available: %s", error)
+
+        with self.lock:
+            self.detected_version = detected_version
+            self.checking = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "concurrency": self.concurrency,
+                "timeout": self.timeout,
+                "running": self.running,
+                "waiting": self.waiting,
+                "runs": self.runs,
+                "failures": self.failures,
+                "timeouts": self.timeouts
+            }
+
+
+def wk_runner():
+    if _global["runner"] is None:
+        _global["runner"] = WkRunner(get_wk_concurrency(), get_wk_timeout())
+    return _global["runner"]
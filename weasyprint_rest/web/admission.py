@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import itertools
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+from ..env import get_admission_concurrency, get_admission_queue_size, get_admission_default_timeout
+
+DEADLINE_HEADER = "X-Request-Timeout"
+# Weight of the latest request in the average service time used to estimate waits
+SERVICE_TIME_WEIGHT = 0.2
+
+_global = {
+    "controller": None
+}
+
+
+class AdmissionController:
+    def __init__(self, concurrency, queue_size):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.tickets = itertools.count()
+        self.next_ticket = 0
+        self.skipped = set()
+        self.running = 0
+        self.waiting = 0
+        self.service_time = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self, timeout=None):
+        started = time.monotonic()
+        with self.condition:
+            if self.waiting == 0 and self.running < self.concurrency:
+                self._admit(0)
+                return
+
+            estimate = self._estimate_wait()
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise TooManyRequests(description="Too many requests are waiting to be printed.",
+                                      retry_after=_retry_after(estimate))
+            if timeout is not None and estimate > timeout:
+                self.rejected += 1
+                raise ServiceUnavailable(description="Request can not be printed within its timeout.",
+                                         retry_after=_retry_after(estimate))
+
+            # Tickets keep waiting requests in arrival order
+            ticket = next(self.tickets)
+            self.waiting += 1
+            try:
+                while ticket != self.next_ticket or self.running >= self.concurrency:
+                    remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        self.rejected += 1
+                        raise ServiceUnavailable(description="Request can not be printed within its timeout.",
+                                                 retry_after=_retry_after(self._estimate_wait()))
+                    self.condition.wait(remaining)
+            except ServiceUnavailable:
+                self._skip(ticket)
+                raise
+            finally:
+                self.waiting -= 1
+
+            self.next_ticket += 1
+            self._admit(time.monotonic() - started)
+            self.condition.notify_all()
+
+    def release(self, service_time):
+        with self.condition:
+            self.running -= 1
+            self.service_time += SERVICE_TIME_WEIGHT * (service_time - self.service_time)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "average_wait_time": self.wait_time / self.admitted if self.admitted else 0,
+                "max_wait_time": self.max_wait_time,
+                "estimated_wait_time": self._estimate_wait()
+            }
+
+    def _admit(self, wait_time):
+        self.running += 1
+        self.admitted += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def _estimate_wait(self):
+        if self.waiting == 0 and self.running < self.concurrency:
+            return 0
+        return (self.waiting // self.concurrency + 1) * self.service_time
+
+    def _skip(self, ticket):
+        # Requests after a timed out one must not wait for its ticket
+        self.skipped.add(ticket)
+        while self.next_ticket in self.skipped:
+            self.skipped.remove(self.next_ticket)
+            self.next_ticket += 1
+        self.condition.notify_all()
+
+
+def _retry_after(estimate):
+    return max(1, math.ceil(estimate))
+
+
+def _get_timeout():
+    timeout = request.headers.get(DEADLINE_HEADER, get_admission_default_timeout())
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        return None
+    return timeout if timeout > 0 else None
+
+
+def admission_controller():
+    if _global["controller"] is None and get_admission_concurrency() > 0:
+        _global["controller"] = AdmissionController(get_admission_concurrency(), get_admission_queue_size())
+    return _global["controller"]
+
+
+def acquire_admission():
+    controller = admission_controller()
+    if controller is None:
+        return lambda: None
+
+    controller.acquire(_get_timeout())
+    started = time.monotonic()
+    return lambda: controller.release(time.monotonic() - started)
+
+
+def admit(func):
+    @wraps(func)
+    def limit_concurrency(*args, **kwargs):
+        release = acquire_admission()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release()
+
+    return limit_concurrency
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from flask import Response
+
+from ..env import get_response_spool_size
+
+CHUNK_SIZE = 64 * 1024
+
+
+def spooled_file():
+    # Kept in memory up to the spool size, larger documents are moved to a temporary file
+    return tempfile.SpooledTemporaryFile(max_size=get_response_spool_size())
+
+
+def content_disposition(file_name, disposition):
+    basename, _ = os.path.splitext(file_name)
+    return '%s; name="%s"; filename="%s.%s"' % (
+        disposition,
+        basename,
+        basename,
+        "pdf"
+    )
+
+
+def _iter_bytes(content):
+    view = memoryview(content)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+
+def _iter_file(file):
+    try:
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def pdf_response(content, file_name, disposition):
+    if isinstance(content, bytes):
+        length = len(content)
+        body = _iter_bytes(content)
+    else:
+        length = content.seek(0, os.SEEK_END)
+        content.seek(0)
+        body = _iter_file(content)
+
+    response = Response(body, mimetype='application/pdf', direct_passthrough=True)
+    response.content_length = length
+    response.headers['Content-Disposition'] = content_disposition(file_name, disposition)
+    return response
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import uuid
+import zipfile
+
+from flask import Response, request, abort, stream_with_context
+from flask_restful import Resource
+from werkzeug.utils import secure_filename
+
+from .print import PrintRequest, _build_template, _parse_request_argument, render_report_template
+from ..admission import acquire_admission
+from ..util import authenticate
+from ...env import get_batch_parallelism, get_bulk_max_documents, get_wk_concurrency
+from ...print.job_store import job_store, public_status, QueueFullError
+from ...print.render_pool import RenderJob, render_pool, map_ordered
+from ...print.reports import RenderedReport
+
+OUTPUT_FORMATS = ["zip", "multipart", "jobs"]
+
+
+class _ChunkBuffer:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def _as_html(html):
+    return RenderedReport(html) if isinstance(html, str) else html
+
+
+def _parse_documents():
+    report = _parse_request_argument("report", None)
+    if report is not None:
+        try:
+            data_set = json.loads(_parse_request_argument("data_set", '[]'))
+        except (ValueError, TypeError) as te:
+            logging.error(te)
+            return abort(400, description="Invalid data provided")
+        if not isinstance(data_set, list) or not all(isinstance(data, dict) for data in data_set):
+            return abort(400, description="Invalid data provided")
+        return [(None, render_report_template(report, **data)) for data in data_set]
+
+    htmls = _parse_request_argument("html[]", [])
+    return [(getattr(html, "filename", None), _as_html(html)) for html in htmls]
+
+
+def _document_names(documents):
+    names = []
+    for index, (file_name, _) in enumerate(documents):
+        basename = os.path.splitext(secure_filename(file_name or ""))[0] or "document-%d" % (index + 1)
+        name = basename + ".pdf"
+        if name in names:
+            name = "%s-%d.pdf" % (basename, index + 1)
+        names.append(name)
+    return names
+
+
+def _parallelism(driver):
+    pool = render_pool()
+    if driver == 'wk':
+        return get_batch_parallelism() or get_wk_concurrency()
+    if pool is not None:
+        return get_batch_parallelism() or pool.size()
+    # Template assets sent with the request are shared streams, in-process renders have to stay sequential
+    return 1
+
+
+def _render_document(print_request):
+    try:
+        return print_request.render_bytes(), None
+    except Exception as e:
+        logging.exception("Document %r could not be printed" % print_request.file_name)
+        return None, str(e)
+
+
+def _zip_stream(print_requests, results):
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for print_request, (pdf_bytes, error) in zip(print_requests, results):
+            if error is None:
+                archive.writestr(print_request.file_name, pdf_bytes)
+            else:
+                archive.writestr(print_request.file_name + ".error.txt", error)
+            yield buffer.take()
+    yield buffer.take()
+
+
+def _multipart_stream(print_requests, results, boundary):
+    for print_request, (pdf_bytes, error) in zip(print_requests, results):
+        content_type = "application/pdf" if error is None else "text/plain; charset=utf-8"
+        content = pdf_bytes if error is None else error.encode()
+        yield (
+            "--%s\r\nContent-Type: %s\r\nContent-Disposition: attachment; filename=\"%s\"\r\n"
+            "Content-Length: %d\r\n\r\n" % (boundary, content_type, print_request.file_name, len(content))
+        ).encode()
+        yield content
+        yield b"\r\n"
+    yield ("--%s--\r\n" % boundary).encode()
+
+
+class BulkPrintAPI(Resource):
+    decorators = [authenticate]
+
+    def __init__(self):
+        super(BulkPrintAPI, self).__init__()
+
+    def post(self):
+        driver = _parse_request_argument("driver", 'weasy')
+        output_format = _parse_request_argument("output", "zip")
+        if driver not in ['weasy', 'wk']:
+            return abort(422, description="Invalid value for driver! only wk or weasy supported")
+        if output_format not in OUTPUT_FORMATS:
+            return abort(422, description="Invalid value for output! only zip, multipart or jobs supported")
+
+        documents = _parse_documents()
+        if len(documents) == 0:
+            return abort(422, description="Required argument 'html[]' or report with data_set is missing.")
+        if len(documents) > get_bulk_max_documents():
+            return abort(413, description="At most %d documents can be printed at once." % get_bulk_max_documents())
+
+        # All documents share one template, so styles and assets are parsed once for all of them
+        template = _build_template()
+        optimize_images = _parse_request_argument("optimize_images", False)
+        options = json.loads(_parse_request_argument("options", '{}')) if driver == 'wk' else None
+        # Template streams are shared by all documents, so they are read once before the documents are rendered
+        render_job = RenderJob.create(None, None, template, optimize_images) \
+            if render_pool() is not None and driver != 'wk' else None
+        print_requests = [
+            PrintRequest(
+                driver,
+                html=html,
+                template=template,
+                options=dict(options) if options is not None else None,
+                optimize_images=optimize_images,
+                password=_parse_request_argument("password", None),
+                file_name=name,
+                render_job=render_job
+            ) for name, (_, html) in zip(_document_names(documents), documents)
+        ]
+
+        if output_format == "jobs":
+            return self._submit_jobs(print_requests)
+
+        release = acquire_admission()
+        try:
+            results = map_ordered(_render_document, print_requests, _parallelism(driver))
+            if output_format == "zip":
+                body = _zip_stream(print_requests, results)
+                mimetype = "application/zip"
+            else:
+                boundary = uuid.uuid4().hex
+                body = _multipart_stream(print_requests, results, boundary)
+                mimetype = "multipart/mixed; boundary=%s" % boundary
+        except BaseException:
+            release()
+            raise
+
+        def generate():
+            # The admission slot is held until the last document was rendered
+            try:
+                yield from body
+            finally:
+                release()
+                for print_request in print_requests:
+                    print_request.close()
+
+        response = Response(stream_with_context(generate()), mimetype=mimetype)
+        if output_format == "zip":
+            file_name = os.path.splitext(_parse_request_argument("file_name", "documents.zip"))[0]
+            response.headers['Content-Disposition'] = 'attachment; filename="%s.zip"' % file_name
+        return response
+
+    def _submit_jobs(self, print_requests):
+        store = job_store()
+        if store is None:
+            return abort(503, description="Print jobs are disabled.")
+
+        statuses = []
+        try:
+            for print_request in print_requests:
+                status = store.submit(print_request.to_job(), request.host_url, None, {
+                    "file_name": print_request.file_name,
+                    "disposition": "attachment"
+                })
+                statuses.append(public_status(status))
+        except QueueFullError as e:
+            return abort(429, description="%s %d of %d documents were submitted." % (
+                str(e), len(statuses), len(print_requests)
+            ))
+        finally:
+            for print_request in print_requests:
+                print_request.close()
+
+        return {"jobs": statuses}, 202
@@ -9,6 +9,21 @@ from pypdf import __version__ as version_pypdf
 from PIL import __version__ as version_pil
 from pdfkit import __version__ as version_pdfkit
 
+from weasyprint_rest.print.asset_directory import asset_directories
+from weasyprint_rest.print.asset_store import asset_store
+from weasyprint_rest.print.font_registry import font_registry, subset_cache
+from weasyprint_rest.print.job_store import job_store
+from weasyprint_rest.print.image_cache import template_image_cache, request_image_cache
+from weasyprint_rest.print.render_pool import render_pool
+from weasyprint_rest.print.result_cache import result_cache
+from weasyprint_rest.print.single_flight import single_flight
+from weasyprint_rest.print.stylesheet_cache import stylesheet_cache
+from weasyprint_rest.print.template_loader import TemplateLoader
+from weasyprint_rest.print.url_fetcher import url_fetcher
+from weasyprint_rest.print.wk_runner import wk_runner
+from weasyprint_rest.web.admission import admission_controller
+from weasyprint_rest.web.uploads import upload_budget
+from weasyprint_rest.web.url_policy import url_policy
 from weasyprint_rest.web.util import is_authenticated
 
 
@@ -19,16 +34,36 @@ class HealthAPI(Resource):
 
     def get(self):
         pong = request.args.get('ping', '')
+        pool = render_pool()
+        if not TemplateLoader().ready.is_set() or (pool is not None and not pool.ready.is_set()):
+            return {"status": "STARTING", **({"pong": pong} if pong else {})}, 503
 
         return {
             "status": "OK",
             **({
                    "weasyprint": version,
-                   "wkhtmltopdf": "0.12.6 (with patched qt)",
+                   "wkhtmltopdf": wk_runner().version(),
                    "pypdf": version_pypdf,
                    "Pillow": version_pil,
                    "pdfkit": version_pdfkit,
-                   "timestamp": round(time.time() * 1000)
+                   "timestamp": round(time.time() * 1000),
+                   "stylesheet_cache": stylesheet_cache().stats(),
+                   "font_registry": font_registry().stats(),
+                   "font_subset_cache": subset_cache().stats(),
+                   "image_cache": {
+                       "template": template_image_cache().stats(),
+                       "request": request_image_cache().stats()
+                   },
+                   "result_cache": result_cache().stats() if result_cache() is not None else None,
+                   "single_flight": single_flight().stats(),
+                   "jobs": job_store().stats() if job_store() is not None else None,
+                   "admission": admission_controller().stats() if admission_controller() is not None else None,
+                   "uploads": upload_budget().stats(),
+                   "wk": wk_runner().stats(),
+                   "asset_directories": asset_directories().stats(),
+                   "asset_store": asset_store().stats(),
+                   "url_policy": url_policy().stats(),
+                   "url_fetcher": url_fetcher().stats()
                } if is_authenticated(request) else {}),
             **({"pong": pong} if pong else {})
         }, 200
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from flask import request, abort, send_file
+from flask_restful import Resource
+
+from .print import PrintRequest, parse_print_request, _parse_request_argument
+from ..response import content_disposition
+from ..util import authenticate, check_url_access
+from ...print.job_store import job_store, public_status, QueueFullError
+
+
+def execute_print_job(job):
+    print_request = PrintRequest.from_job(job)
+    try:
+        return print_request.render_bytes()
+    finally:
+        print_request.close()
+
+
+def _get_job_store():
+    store = job_store()
+    if store is None:
+        return abort(503, description="Print jobs are disabled.")
+    return store
+
+
+def _get_job_status(store, job_id):
+    status = store.status(job_id)
+    if status is None:
+        return abort(404, description="Print job %r was not found." % job_id)
+    return status
+
+
+class PrintJobsAPI(Resource):
+    decorators = [authenticate]
+
+    def __init__(self):
+        super(PrintJobsAPI, self).__init__()
+
+    def post(self):
+        store = _get_job_store()
+
+        callback_url = _parse_request_argument("callback_url", None)
+        if callback_url is not None and not check_url_access(callback_url):
+            return abort(
+                403, description="Callback URL %r was blocked because of restriction definitions." % callback_url
+            )
+
+        print_request = parse_print_request()
+        try:
+            status = store.submit(print_request.to_job(), request.host_url, callback_url, {
+                "file_name": print_request.file_name,
+                "disposition": print_request.disposition
+            })
+        except QueueFullError as e:
+            return abort(429, description=str(e))
+        finally:
+            print_request.close()
+
+        result = public_status(status)
+        return result, 202, {"Location": result["status_url"]}
+
+
+class PrintJobAPI(Resource):
+    decorators = [authenticate]
+
+    def __init__(self):
+        super(PrintJobAPI, self).__init__()
+
+    def get(self, job_id):
+        return public_status(_get_job_status(_get_job_store(), job_id)), 200
+
+
+class PrintJobResultAPI(Resource):
+    decorators = [authenticate]
+
+    def __init__(self):
+        super(PrintJobResultAPI, self).__init__()
+
+    def get(self, job_id):
+        store = _get_job_store()
+        status = _get_job_status(store, job_id)
+        if status["status"] != "done":
+            return abort(409, description="Print job %r is %s." % (job_id, status["status"]))
+
+        response = send_file(store.result_path(job_id), mimetype='application/pdf')
+        response.headers['Content-Disposition'] = content_disposition(status["file_name"], status["disposition"])
+        return response
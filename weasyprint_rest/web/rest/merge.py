@@ -4,16 +4,22 @@
 import io
 import json
 import os
-import uuid
 
 from PIL import Image
-from flask import current_app, request, abort, jsonify, make_response
+from flask import current_app, request, abort, jsonify
 from flask_restful import Resource
-from pypdf import PdfMerger, PageRange
+from pypdf import PageRange
 from werkzeug.datastructures import FileStorage
-from werkzeug.utils import secure_filename
 
-from ..util import authenticate, encrypt
+from ..admission import admit
+from ..response import spooled_file, pdf_response
+from ..uploads import map_upload
+from ..util import authenticate
+from ...env import get_merge_image_workers
+from ...print.pdf_merger import PdfMergeEngine
+from ...print.render_pool import map_ordered
+
+A4_INCHES = (8.27, 11.69)
 
 
 def _get_request_list_or_value(request_dict, name):
@@ -86,17 +92,49 @@ def _may_get_dict_value(dict_values, key, default=None):
     return dict_values[key]
 
 
-def image_to_pdf(uploaded_file):
-    file_name, file_extension = os.path.splitext(uploaded_file.filename)
-    converted_file_name = "{0}-{1}.pdf".format(str(uuid.uuid1()), secure_filename(file_name))
-    image_1 = Image.open(uploaded_file)
-    im_1 = image_1.convert('RGB')
-    im_1.save(converted_file_name)
-    return converted_file_name
+def _fit_page(image, dpi):
+    # Images are scaled down to fit an A4 page in the orientation of the image at the requested resolution
+    page_width, page_height = A4_INCHES if image.width <= image.height else A4_INCHES[::-1]
+    scale = min(page_width * dpi / image.width, page_height * dpi / image.height)
+    if scale >= 1:
+        return image
+
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # JPEG images can be decoded at a reduced size right away
+    image.draft('RGB', size)
+    return image.resize(size, Image.LANCZOS)
+
+
+def image_to_pdf(uploaded_file, dpi=None, quality=None):
+    image = Image.open(uploaded_file)
+    options = {}
+    if dpi is not None:
+        image = _fit_page(image, dpi)
+        options['resolution'] = dpi
+    if quality is not None:
+        options['quality'] = quality
+
+    output = io.BytesIO()
+    image.convert('RGB').save(output, 'PDF', **options)
+    output.seek(0)
+    return output
+
+
+def _parse_int_argument(name):
+    value = _parse_request_argument(name, None)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return abort(400, description="Invalid value for {0}".format(name))
+    if value <= 0:
+        return abort(400, description="Invalid value for {0}".format(name))
+    return value
 
 
 class MergeAPI(Resource):
-    decorators = [authenticate]
+    decorators = [admit, authenticate]
 
     def __init__(self):
         super(MergeAPI, self).__init__()
@@ -118,49 +156,46 @@ class MergeAPI(Resource):
 
         password = _get_request_argument("password", None)
         pages = _parse_request_argument("pages", [])
+        image_dpi = _parse_int_argument("image_dpi")
+        image_quality = _parse_int_argument("image_quality")
 
-        merger = PdfMerger()
+        merger = PdfMergeEngine()
         file_map = {}
-        for uploaded_file in request.files.getlist('files[]'):
-            file_name, file_extension = os.path.splitext(uploaded_file.filename)
-            self.validate_uploaded_file_ext(file_extension)
-            self.validate_duplicate_uploaded_file_name(file_name)
-
-            file_map[uploaded_file.filename] = uploaded_file
-            if file_extension != '.pdf':
-                converted_file_name = image_to_pdf(uploaded_file)
-                with open(converted_file_name, 'rb') as bites:
-                    file_map[uploaded_file.filename] = bites
-
-        for page_map in _read_page_definition(pages):
-            if file_map.get(page_map['file']) is not None:
-                if "range" in page_map and page_map['range'] != ':' and page_map['range'] != '':
-                    merger.append(file_map[page_map['file']], pages=PageRange(page_map['range']))
+        mapped = []
+        try:
+            images = []
+            for uploaded_file in request.files.getlist('files[]'):
+                file_name, file_extension = os.path.splitext(uploaded_file.filename)
+                self.validate_uploaded_file_ext(file_extension)
+                self.validate_duplicate_uploaded_file_name(file_name)
+
+                if file_extension == '.pdf':
+                    file_map[uploaded_file.filename] = map_upload(uploaded_file, mapped)
                 else:
-                    merger.append(file_map[page_map['file']])
-
-        bytes_stream = io.BytesIO()
-
-        if password is None:
-            merger.write(bytes_stream)
-        else:
-            in_file = io.BytesIO()
-            merger.write(in_file)
-            encrypt(in_file, password, bytes_stream)
-
-        basename, _ = os.path.splitext(_parse_request_argument("file_name", 'merged.pdf'))
-
-        response = make_response(bytes_stream.getvalue())
-        response.mimetype = 'application/pdf'
-        disposition = _parse_request_argument("disposition", "inline")
-        response.headers['Content-Disposition'] = '%s; name="%s"; filename="%s.%s"' % (
-            disposition,
-            basename,
-            basename,
-            "pdf"
+                    images.append(uploaded_file)
+
+            converted = map_ordered(
+                lambda image: image_to_pdf(image, image_dpi, image_quality), images, get_merge_image_workers()
+            )
+            for uploaded_file, pdf_file in zip(images, converted):
+                file_map[uploaded_file.filename] = pdf_file
+
+            for page_map in _read_page_definition(pages):
+                if file_map.get(page_map['file']) is not None:
+                    if "range" in page_map and page_map['range'] != ':' and page_map['range'] != '':
+                        merger.append(page_map['file'], file_map[page_map['file']], pages=PageRange(page_map['range']))
+                    else:
+                        merger.append(page_map['file'], file_map[page_map['file']])
+
+            output = spooled_file()
+            merger.write(output, password=password)
+        finally:
+            merger.close()
+            for mapped_file in mapped:
+                mapped_file.close()
+
+        return pdf_response(
+            output,
+            _parse_request_argument("file_name", 'merged.pdf'),
+            _parse_request_argument("disposition", "inline")
         )
-
-        merger.close()
-        bytes_stream.close()
-
-        return response
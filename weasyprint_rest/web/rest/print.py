@@ -1,19 +1,27 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import hashlib
 import io
+import itertools
 import json
 import logging
-import os
 
 from flask import request, abort, make_response, render_template
 from flask_restful import Resource
-from pypdf import PdfMerger
 from werkzeug.datastructures import FileStorage
 
-from ..util import authenticate
+from ..admission import admit
+from ..response import spooled_file, pdf_response
+from ..util import authenticate, encrypt
+from ...env import get_batch_parallelism, get_wk_batch_size, is_true
+from ...print.pdf_merger import PdfMergeEngine
+from ...print.render_pool import RenderJob, read_html, render_pool, map_ordered
+from ...print.reports import RenderedReport
+from ...print.result_cache import result_cache
+from ...print.single_flight import single_flight
 from ...print.template import Template
 from ...print.template_loader import TemplateLoader
-from ...print.weasyprinter import WeasyPrinter, encrypt_pdf
+from ...print.weasyprinter import WeasyPrinter
 
 
 def _get_request_list_or_value(request_dict, name):
@@ -71,110 +79,343 @@ def _build_template():
     return Template(styles=styles, assets=assets, base_template=base_template)
 
 
-def convert_html2pdf(driver, html, optimize_images, template, url):
+def convert_html2pdf(driver, html, optimize_images, template, url, options=None):
+    pool = render_pool()
+    if pool is not None and driver != 'wk':
+        return pool.render(RenderJob.create(html, url, template, optimize_images))
+
     printer = WeasyPrinter(html=html, url=url, template=template)
-    options = None
-    if driver == 'wk':
-        options = json.loads(_parse_request_argument("options", '{}'))
     pdf_bytes = printer.write(optimize_images, driver=driver, options=options)
     return pdf_bytes
 
 
 def render_report_template(report, **data):
-    content = render_template(report, **data)
-    return FileStorage(
-        stream=io.BytesIO(bytes(content, encoding='utf8')),
-        content_type="text/html"
-    )
+    return RenderedReport(render_template(report, **data))
 
 
-def get_multi_report_pdf(driver, optimize_images, report, template, data_arr):
-    merger = PdfMerger()
-    for data in data_arr:
-        h = render_report_template(report, **data)
-        pdf_bytes = convert_html2pdf(driver, h, optimize_images, template, None)
-        merger.append(io.BytesIO(pdf_bytes))
-    bytes_stream = io.BytesIO()
-    merger.write(bytes_stream)
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
 
-    return bytes_stream.getvalue()
 
+def iter_records(stream):
+    # One JSON object per line, parsed only when the next entry is rendered
+    count = 0
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            logging.error(e)
+            return abort(400, description="Invalid data provided on line %d" % number)
+        if not isinstance(record, dict):
+            return abort(400, description="Invalid data provided on line %d" % number)
+        count += 1
+        yield record
 
-class PrintAPI(Resource):
-    decorators = [authenticate]
+    if count == 0:
+        return abort(400, description="No data provided")
 
-    def __init__(self):
-        super(PrintAPI, self).__init__()
 
-    def post(self):
+def _ndjson_stream():
+    if request.mimetype in NDJSON_MIMETYPES:
+        return request.stream
+    if "data_set" in request.files:
+        return request.files["data_set"].stream
+    return None
 
-        driver = _parse_request_argument("driver", 'weasy')
-        url = _parse_request_argument("url", None)
-        report = _parse_request_argument("report", None)
-        optimize_images = _parse_request_argument("optimize_images", False)
-        data_set = _parse_request_argument("data_set", None)
 
-        if driver not in ['weasy', 'wk']:
-            return abort(422, description="Invalid value for driver! only wk or weasy supported")
+def write_multi_report_pdf(output, driver, optimize_images, htmls, template, options=None, password=None):
+    merger = PdfMergeEngine()
+    for index, pdf_bytes in enumerate(_convert_reports(driver, optimize_images, htmls, template, options)):
+        source = io.BytesIO(pdf_bytes)
+        merger.append(index, source)
+        # Every entry is appended once, only its copy in the output is kept
+        merger.release(index)
+        source.close()
+    merger.write(output, password=password)
+    merger.close()
 
-        html = None
-        pdf_bytes = None
-        template = _build_template()
 
-        if report is not None and data_set is not None:
+def get_multi_report_pdf(driver, optimize_images, htmls, template, options=None):
+    bytes_stream = io.BytesIO()
+    write_multi_report_pdf(bytes_stream, driver, optimize_images, htmls, template, options)
 
-            try:
-                data_arr = json.loads(_parse_request_argument("data_set", '[]'))
-            except (ValueError, TypeError) as te:
-                logging.error(te)
-                return abort(400, description="Invalid data provided")
-            except Exception as te:
-                logging.error(te)
-                return abort(400, description="Unknown error occurred")
+    return bytes_stream.getvalue()
 
-            if not isinstance(data_arr, list) or len(data_arr) == 0:
-                return abort(400, description="Unknown error occurred")
 
-            pdf_bytes = get_multi_report_pdf(driver, optimize_images, report, template, data_arr)
-        elif report is not None:
-            try:
-                html = render_report_template(report, **(json.loads(_parse_request_argument("data", '{}'))))
-            except (ValueError, TypeError) as te:
-                logging.error(te)
-                return abort(400, description="Invalid data provided")
-            except Exception as te:
-                logging.error(te)
-                return abort(400, description="Unknown error occurred")
+def _convert_reports(driver, optimize_images, htmls, template, options):
+    if driver == 'wk' and get_wk_batch_size() > 1 and not _has_header_or_footer(options):
+        htmls = iter(htmls)
+        while True:
+            batch = list(itertools.islice(htmls, get_wk_batch_size()))
+            if not batch:
+                return
+            yield WeasyPrinter(template=template).write_batch_with_pdfkit(batch, options)
+
+    pool = render_pool()
+    if pool is None or driver == 'wk':
+        # Template assets are shared streams, in-process renders have to stay sequential
+        for h in htmls:
+            yield convert_html2pdf(driver, h, optimize_images, template, None, options)
+        return
+
+    job = RenderJob.create(None, None, template, optimize_images)
+    jobs = (job.with_html(read_html(h)) for h in htmls)
+    yield from map_ordered(pool.render, jobs, get_batch_parallelism() or pool.size())
+
+
+def _has_header_or_footer(options):
+    # [page] and [topage] in headers and footers would count the pages of the whole batch
+    return any(name.lstrip("-").startswith(("header-", "footer-")) for name in (options or {}))
+
+
+def get_single_report_pdf(optimize_images, htmls, template):
+    pool = render_pool()
+    if pool is not None:
+        job = RenderJob.create(None, None, template, optimize_images)
+        return pool.render(job.with_html([read_html(h) for h in htmls]))
+
+    return WeasyPrinter(template=template).write_combined(htmls, optimize_images)
+
+
+def _render_pdf(driver, html, htmls, url, optimize_images, template, options, single_document):
+    if htmls is None:
+        return convert_html2pdf(driver, html, optimize_images, template, url, options)
+    if single_document:
+        return get_single_report_pdf(optimize_images, htmls, template)
+    return get_multi_report_pdf(driver, optimize_images, htmls, template, options)
+
+
+def _render_key(driver, htmls, url, template, options, optimize_images, single_document):
+    # Identifies the output of a render, every input that changes the PDF has to be part of it
+    digest = hashlib.sha256()
+    for part in (driver, url or "", str(optimize_images), str(single_document),
+                 json.dumps(options, sort_keys=True), template.get_content_signature()):
+        digest.update(hashlib.sha256(part.encode()).digest())
+    for html in htmls:
+        digest.update(hashlib.sha256(_read_html(html)).digest())
+    return digest.hexdigest()
+
+
+def _not_modified(cache_key):
+    response = make_response("", 304)
+    response.set_etag(cache_key)
+    return response
+
+
+class PrintRequest:
+    def __init__(self, driver, html=None, htmls=None, url=None, template=None, options=None, optimize_images=False,
+                 single_document=False, password=None, file_name="document.pdf", disposition="inline",
+                 streamed=False, render_job=None):
+        self.driver = driver
+        self.html = html
+        self.htmls = htmls
+        self.url = url
+        self.template = template if template is not None else Template()
+        self.options = options
+        self.optimize_images = optimize_images
+        self.single_document = single_document
+        self.password = password
+        self.file_name = file_name
+        self.disposition = disposition
+        self.streamed = streamed
+        self.render_job = render_job
+
+        # Streamed entries are read only once while rendering, they can not be identified up front
+        self.render_key = _render_key(
+            driver, htmls or ([html] if html is not None else []), url, self.template, options, optimize_images,
+            single_document
+        ) if not streamed else None
+        # Remote content may change at any time and encrypted output differs on every write
+        self.cache_key = self.render_key if url is None and password is None else None
+
+    def render(self):
+        cache = result_cache()
+        if cache is not None and self.cache_key is not None:
+            pdf_bytes = cache.get(self.cache_key)
+            if pdf_bytes is not None:
+                return pdf_bytes
+
+        if self.render_key is None:
+            return self._render()
+
+        # Identical requests in flight wait for the first one instead of rendering the same document again
+        return single_flight().do(self.render_key, self._render)
+
+    def _render(self):
+        if self.render_job is not None:
+            # Template files of the job were read once for all documents sharing them
+            pdf_bytes = render_pool().render(self.render_job.with_html(read_html(self.html)))
+        else:
+            pdf_bytes = _render_pdf(
+                self.driver, self.html, self.htmls, self.url, self.optimize_images, self.template, self.options,
+                self.single_document
+            )
+        cache = result_cache()
+        if cache is not None and self.cache_key is not None:
+            cache.put(self.cache_key, pdf_bytes)
+        return pdf_bytes
+
+    def write(self, output):
+        if self.htmls is not None and not self.single_document:
+            # The entries are merged and encrypted by the same write
+            write_multi_report_pdf(
+                output, self.driver, self.optimize_images, self.htmls, self.template, self.options, self.password
+            )
+            return
+
+        if self.password is None:
+            output.write(self.render())
+            return
+
+        # WeasyPrint can not encrypt, its output is parsed once and written encrypted straight into the output
+        encrypt(io.BytesIO(self.render()), self.password, output)
+
+    def render_bytes(self):
+        if self.password is None and not self.streamed:
+            return self.render()
+        output = io.BytesIO()
+        self.write(output)
+        return output.getvalue()
+
+    def to_job(self):
+        render_job = RenderJob.create(self.html, self.url, self.template, self.optimize_images)
+        if self.htmls is not None:
+            render_job = render_job.with_html([read_html(h) for h in self.htmls])
+        files = []
+        return {
+            "render": render_job.dump(files),
+            "files": files,
+            "driver": self.driver,
+            "options": self.options,
+            "single_document": self.single_document,
+            "password": self.password,
+            "file_name": self.file_name,
+            "disposition": self.disposition
+        }
+
+    @classmethod
+    def from_job(cls, job):
+        render_job = RenderJob.load(job["render"], job["files"])
+        html = render_job.build_html()
+        return cls(
+            job["driver"],
+            html=html if not isinstance(html, list) else None,
+            htmls=html if isinstance(html, list) else None,
+            url=render_job.url,
+            template=render_job.build_template(),
+            options=job["options"],
+            optimize_images=render_job.optimize_images,
+            single_document=job["single_document"],
+            password=job["password"],
+            file_name=job["file_name"],
+            disposition=job["disposition"]
+        )
 
-        elif url is None:
-            html = _parse_request_argument("html", None, "file", {
-                "content_type": "text/html"
-            })
+    def close(self):
+        if self.streamed:
+            return
+        for html in [self.html] + (self.htmls or []):
+            if hasattr(html, 'close'):
+                html.close()
 
-        if html is None and url is None and pdf_bytes is None:
-            return abort(422, description="Required argument 'html' or 'url' or report is missing.")
 
-        if pdf_bytes is None:
-            pdf_bytes = convert_html2pdf(driver, html, optimize_images, template, url)
+def _read_html(html):
+    content = html.stream.read()
+    html.stream.seek(0)
+    return content
 
-        password = _parse_request_argument("password", None)
 
-        content = encrypt_pdf(pdf_bytes, password=password)
+def parse_print_request():
+    driver = _parse_request_argument("driver", 'weasy')
+    url = _parse_request_argument("url", None)
+    report = _parse_request_argument("report", None)
+    optimize_images = _parse_request_argument("optimize_images", False)
+    data_set = _parse_request_argument("data_set", None)
+
+    if driver not in ['weasy', 'wk']:
+        return abort(422, description="Invalid value for driver! only wk or weasy supported")
+
+    html = None
+    htmls = None
+    template = _build_template()
+
+    records = _ndjson_stream() if report is not None else None
+    if records is not None:
+        htmls = (render_report_template(report, **data) for data in iter_records(records))
+    elif report is not None and data_set is not None:
+
+        try:
+            data_arr = json.loads(_parse_request_argument("data_set", '[]'))
+        except (ValueError, TypeError) as te:
+            logging.error(te)
+            return abort(400, description="Invalid data provided")
+        except Exception as te:
+            logging.error(te)
+            return abort(400, description="Unknown error occurred")
+
+        if not isinstance(data_arr, list) or len(data_arr) == 0:
+            return abort(400, description="Unknown error occurred")
+
+        htmls = [render_report_template(report, **data) for data in data_arr]
+    elif report is not None:
+        try:
+            html = render_report_template(report, **(json.loads(_parse_request_argument("data", '{}'))))
+        except (ValueError, TypeError) as te:
+            logging.error(te)
+            return abort(400, description="Invalid data provided")
+        except Exception as te:
+            logging.error(te)
+            return abort(400, description="Unknown error occurred")
+
+    elif url is None:
+        html = _parse_request_argument("html", None, "file", {
+            "content_type": "text/html"
+        })
+
+    if html is None and url is None and htmls is None:
+        return abort(422, description="Required argument 'html' or 'url' or report is missing.")
+
+    return PrintRequest(
+        driver,
+        html=html,
+        htmls=htmls,
+        url=url,
+        template=template,
+        options=json.loads(_parse_request_argument("options", '{}')) if driver == 'wk' else None,
+        optimize_images=optimize_images,
+        single_document=driver != 'wk' and is_true(_parse_request_argument("single_document", "false")),
+        password=_parse_request_argument("password", None),
+        file_name=_parse_request_argument("file_name", 'document.pdf'),
+        disposition=_parse_request_argument("disposition", "inline"),
+        streamed=records is not None
+    )
 
-        # build response
-        response = make_response(content)
-        basename, _ = os.path.splitext(_parse_request_argument("file_name", 'document.pdf'))
-        response.headers['Content-Type'] = 'application/pdf'
-        disposition = _parse_request_argument("disposition", "inline")
-
-        response.headers['Content-Disposition'] = '%s; name="%s"; filename="%s.%s"' % (
-            disposition,
-            basename,
-            basename,
-            "pdf"
-        )
 
-        if hasattr(html, 'close'):
-            html.close()
+class PrintAPI(Resource):
+    decorators = [admit, authenticate]
+
+    def __init__(self):
+        super(PrintAPI, self).__init__()
+
+    def post(self):
+        print_request = parse_print_request()
+
+        try:
+            if print_request.cache_key is not None and request.if_none_match.contains(print_request.cache_key):
+                return _not_modified(print_request.cache_key)
+
+            if print_request.password is None and not print_request.streamed:
+                content = print_request.render()
+            else:
+                content = spooled_file()
+                print_request.write(content)
+        finally:
+            print_request.close()
+
+        # build response
+        response = pdf_response(content, print_request.file_name, print_request.disposition)
+        if print_request.cache_key is not None:
+            response.set_etag(print_request.cache_key)
 
         return response
@@ -1,7 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from .rest.bulk import BulkPrintAPI
 from .rest.health import HealthAPI
+from .rest.jobs import PrintJobsAPI, PrintJobAPI, PrintJobResultAPI
 from .rest.merge import MergeAPI
 from .rest.print import PrintAPI
 
@@ -9,4 +11,8 @@ from .rest.print import PrintAPI
 def register_routes(api):
     api.add_resource(HealthAPI, '/api/v1.0/health')
     api.add_resource(PrintAPI, '/api/v1.0/print')
+    api.add_resource(BulkPrintAPI, '/api/v1.0/print/bulk')
+    api.add_resource(PrintJobsAPI, '/api/v1.0/print/jobs')
+    api.add_resource(PrintJobAPI, '/api/v1.0/print/jobs/<string:job_id>')
+    api.add_resource(PrintJobResultAPI, '/api/v1.0/print/jobs/<string:job_id>/result')
     api.add_resource(MergeAPI, '/api/v1.0/merge')
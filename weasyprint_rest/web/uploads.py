@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import tempfile
+import threading
+
+from flask import Request, request, g
+from werkzeug.exceptions import ServiceUnavailable
+
+from ..env import (
+    get_upload_spool_size, get_upload_request_memory, get_upload_in_flight_limit, get_max_upload_size
+)
+
+_global = {
+    "budget": None
+}
+
+
+class UploadBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, size):
+        with self.lock:
+            # A single upload larger than the limit is still accepted when nothing else is in flight
+            if 0 < self.limit < self.in_flight + size and self.in_flight > 0:
+                self.rejected += 1
+                return False
+            self.in_flight += size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.in_flight -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected
+            }
+
+
+class SpoolingRequest(Request):
+    upload_memory = 0
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Every part may keep up to the spool size in memory, the request as a whole its memory budget
+        spool_size = get_upload_spool_size()
+        if self.upload_memory + spool_size > get_upload_request_memory():
+            return tempfile.TemporaryFile("rb+")
+
+        self.upload_memory += spool_size
+        return tempfile.SpooledTemporaryFile(max_size=spool_size, mode="rb+")
+
+
+def map_upload(uploaded_file, mapped):
+    # Spooled uploads are read through a memory map, so their pages stay in the page cache instead of the heap
+    stream = uploaded_file.stream
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    if size <= get_upload_spool_size() or not hasattr(stream, "fileno"):
+        return uploaded_file
+
+    mapped_file = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped.append(mapped_file)
+    return mapped_file
+
+
+def upload_budget():
+    if _global["budget"] is None:
+        _global["budget"] = UploadBudget(get_upload_in_flight_limit())
+    return _global["budget"]
+
+
+def _reserve_upload():
+    if request.method not in ("POST", "PUT"):
+        return
+
+    size = request.content_length if request.content_length is not None else get_max_upload_size()
+    if not upload_budget().acquire(size):
+        raise ServiceUnavailable(description="Too many uploads are in progress.", retry_after=1)
+    g.upload_size = size
+
+
+def _release_upload(_):
+    size = g.pop("upload_size", None)
+    if size is not None:
+        upload_budget().release(size)
+
+
+def register_upload_handling(app):
+    app.request_class = SpoolingRequest
+    app.before_request(_reserve_upload)
+    app.teardown_request(_release_upload)
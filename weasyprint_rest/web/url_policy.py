@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import json
+import logging
+import re
+import socket
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from ..env import (
+    get_allowed_url_pattern, get_blocked_url_pattern, get_url_access_rules, get_url_policy_cache_size
+)
+
+# Longer URLs, usually data URLs, are decided without being cached
+MAX_CACHED_URL_LENGTH = 2048
+
+_global = {
+    "policy": None,
+    "source": None
+}
+
+
+class UrlRule:
+    def __init__(self, action, scheme=None, host=None, prefix=None, cidr=None):
+        if action not in ("allow", "block"):
+            raise ValueError("Unknown URL rule action %r" % action)
+        self.allow = action == "allow"
+        self.scheme = scheme.lower() if scheme is not None else None
+        self.host = host.lower() if host is not None else None
+        self.prefix = prefix
+        self.network = ipaddress.ip_network(cidr, strict=False) if cidr is not None else None
+
+    def matches(self, url, parts, addresses=None):
+        if self.scheme is not None and parts.scheme != self.scheme:
+            return False
+        if self.host is not None and not _host_matches(parts.hostname, self.host):
+            return False
+        if self.prefix is not None and not url.startswith(self.prefix):
+            return False
+        if self.network is not None:
+            if addresses is None:
+                addresses = _addresses(parts.hostname)
+            if not any(address in self.network for address in addresses):
+                return False
+        return True
+
+
+def _host_matches(hostname, host):
+    if hostname is None:
+        return False
+    if host.startswith("*."):
+        return hostname.endswith(host[1:])
+    return hostname == host
+
+
+def _is_address(hostname):
+    try:
+        ipaddress.ip_address(hostname)
+        return True
+    except ValueError:
+        return False
+
+
+def _addresses(hostname):
+    if not hostname:
+        return []
+    try:
+        return [ipaddress.ip_address(hostname)]
+    except ValueError:
+        pass
+    try:
+        return [ipaddress.ip_address(info[4][0].split("%")[0]) for info in socket.getaddrinfo(hostname, None)]
+    except (OSError, UnicodeError):
+        return []
+
+
+class UrlPolicy:
+    def __init__(self, allowed_pattern, blocked_pattern, rules=None, cache_size=4096):
+        self.allowed = re.compile(allowed_pattern)
+        self.blocked = re.compile(blocked_pattern)
+        self.rules = rules if rules is not None else []
+        self.has_networks = any(rule.network is not None for rule in self.rules)
+        self.cache_size = cache_size
+        self.decisions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def allows(self, url, address=None):
+        if address is not None and self.has_networks:
+            # The address a connection was made to is checked as is, without resolving the host again
+            return self._decide(url, [ipaddress.ip_address(address.split("%")[0])])[0]
+
+        cacheable = len(url) <= MAX_CACHED_URL_LENGTH and self.cache_size > 0
+        if cacheable:
+            with self.lock:
+                decision = self.decisions.get(url)
+                if decision is not None:
+                    self.decisions.move_to_end(url)
+                    self.hits += 1
+                    return decision
+                self.misses += 1
+
+        decision, resolved = self._decide(url)
+        # Decisions on resolved addresses are made again every time, the host may resolve differently later
+        if cacheable and not resolved:
+            with self.lock:
+                self.decisions[url] = decision
+                while len(self.decisions) > self.cache_size:
+                    self.decisions.popitem(last=False)
+        return decision
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rules": len(self.rules),
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.decisions)
+            }
+
+    def _decide(self, url, addresses=None):
+        # Rules are checked in order, the first matching one decides before the patterns are used
+        resolved = False
+        if self.rules:
+            try:
+                parts = urlsplit(url)
+            except ValueError:
+                return False, False
+            for rule in self.rules:
+                if rule.network is not None and addresses is None and not _is_address(parts.hostname):
+                    resolved = True
+                if rule.matches(url, parts, addresses):
+                    return rule.allow, resolved
+
+        if self.allowed.match(url):
+            return True, resolved
+        if self.blocked.match(url):
+            return False, resolved
+        return True, resolved  # pragma: no cover
+
+
+class _BlockAll:
+    def allows(self, url, address=None):
+        return False
+
+    def stats(self):
+        return None
+
+
+def compile_policy(allowed_pattern, blocked_pattern, rules, cache_size):
+    try:
+        return UrlPolicy(
+            allowed_pattern,
+            blocked_pattern,
+            [UrlRule(**rule) for rule in json.loads(rules)] if rules else [],
+            cache_size
+        )
+    except (re.error, ValueError, TypeError) as e:
+        logging.error(
+            "Could not parse the URL access configuration correctly, therefore all URLs are blocked. "
+            "Please check your configuration: %s" % e
+        )
+        return _BlockAll()
+
+
+def url_policy():
+    # Compiled once and again only if the configuration changes
+    source = (get_allowed_url_pattern(), get_blocked_url_pattern(), get_url_access_rules())
+    if _global["source"] != source:
+        _global["policy"] = compile_policy(*source, get_url_policy_cache_size())
+        _global["source"] = source
+    return _global["policy"]
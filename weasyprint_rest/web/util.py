@@ -4,22 +4,16 @@
 """Alternative version of the ToDo RESTful server implemented using the
 Flask-RESTful extension."""
 
-import re
-import logging
-
 from flask import abort, request
 from functools import wraps
 from pypdf import PdfWriter, PdfReader
 
-from ..env import (
-    get_api_key, get_allowed_url_pattern, get_blocked_url_pattern
-)
+from .url_policy import url_policy
+from ..env import get_api_key
 
 
 def encrypt(in_file, password, out_stream):
-    pdf_reader = PdfReader(in_file)
-    pdf_writer = PdfWriter()
-    pdf_writer.append_pages_from_reader(pdf_reader)
+    pdf_writer = PdfWriter(clone_from=PdfReader(in_file))
     pdf_writer.encrypt(password, password + "owner")
     pdf_writer.write(out_stream)
 
@@ -47,19 +41,5 @@ def is_authenticated(req):
     )
 
 
-def check_url_access(url):
-    allowed_url_pattern = get_allowed_url_pattern()
-    blocked_url_pattern = get_blocked_url_pattern()
-
-    try:
-        if re.match(allowed_url_pattern, url):
-            return True
-        if re.match(blocked_url_pattern, url):
-            return False
-        return True  # pragma: no cover
-    except Exception:  # pragma: no cover
-        logging.error(
-            "Could not parse one of the URL Patterns correctly. Therefor the URL %r was " +
-            "blocked. Please check your configuration." % url
-        )
-        return False
+def check_url_access(url, address=None):
+    return url_policy().allows(url, address)